@@ -0,0 +1,144 @@
+"""The dashboard's analysis, without the dashboard.
+
+Everything one view shows (the filter chain, tile probabilities and quantiles, the per-bucket
+chart counts) as plain functions of a DataFrame, its FilterIndex or aggregate cube, and a
+selection. Nothing here imports Streamlit: app.py calls these behind its caches, and
+report.py calls them for every combination of filters at once.
+
+    from analysis import make_selections, view_results
+    selections = make_selections({'Instrument': 'NQ', 'RDR_M7Box_Direction': 'Long', 'RDR Model': ['All']})
+    summary = view_results(df, 'RDR', selections)
+"""
+from dataclasses import replace
+
+import numpy as np
+
+from charts import CHART_SPECS, TIME_CHART_SPECS, spec_histogram, time_histogram
+from compare import full_windows
+from cube import build_cube
+from filters import FilterIndex
+from metrics import EXTENSION_TABLE, RETRACEMENT_TABLE, TABLE_QUANTILES, summarize_tiles, tile_columns
+from profiling import stage
+from schema import std_columns
+from store import column_ranges
+
+ALL = 'All'
+
+
+def make_selections(choices):
+    """{column: [values]} from widget-style choices, where "All" (alone or in a list) means no filter."""
+    selections = {}
+    for col, choice in choices.items():
+        values = list(choice) if isinstance(choice, (list, tuple)) else [choice]
+        if ALL not in values:
+            selections[col] = values
+    return selections
+
+
+def select_rows(filter_index, selections, windows=None):
+    """Positions of the rows matching every selection and inside every (lo, hi) window."""
+    selection = filter_index.everything()
+    for col, values in selections.items():
+        selection &= filter_index.match(col, values)
+    for col, (lo, hi) in (windows or {}).items():
+        selection &= filter_index.in_range(col, lo, hi)
+    return filter_index.rows(selection)
+
+
+def gather(df, rows, columns):
+    """`columns` of the rows at positions `rows`, as a new frame.
+
+    The dataset is shared by every session, so this is the only copy a selection makes, and it
+    holds just the selected rows of the columns the caller reads.
+    """
+    return df.iloc[rows, [df.columns.get_loc(col) for col in columns]]
+
+
+def window_cube(df, filter_index, dr_range, windows, block_edges=None):
+    """Cube of the rows inside the (full) slider `windows`, which the cube path answers from."""
+    with stage('build_cube', len(df)) as built:
+        rows = select_rows(filter_index, {}, windows)
+        built.rows_out = len(rows)
+        return build_cube(df.iloc[rows], dr_range, block_edges)
+
+
+def rows_results(df, dr_range, value_ranges=None):
+    """(row count, tile stats, {spec: (counts, labels)}) over every row of `df`.
+
+    Chart buckets span `value_ranges` ({column: (min, max)}) when given, so they line up
+    with the dashboard's whatever the filters.
+    """
+    value_ranges = value_ranges or {}
+    with stage('tiles', len(df)):
+        tile_stats = summarize_tiles(tile_columns(df, dr_range), RETRACEMENT_TABLE, EXTENSION_TABLE, TABLE_QUANTILES)
+    with stage('binning', len(df)):
+        chart_counts = {spec: spec_histogram(spec, df, dr_range, value_ranges.get(spec.column_for(dr_range)))
+                        for spec in CHART_SPECS}
+    return len(df), tile_stats, chart_counts
+
+
+def cube_results(cube, dr_range, selections):
+    """The same as `rows_results`, for a purely categorical selection, from a (segmented) cube."""
+    with stage('cube_select') as selected:
+        cells = cube.select(selections)
+        total_count = selected.rows_out = cube.count(cells)
+    with stage('tiles', total_count):
+        tile_inputs = {(kind, measure): cube.column(f'{dr_range}_{kind}_Max_{measure}_STD', cells)
+                       for kind in ('M7Box', 'DR') for measure in ('Retracement', 'Extension')}
+        tile_stats = summarize_tiles(tile_inputs, RETRACEMENT_TABLE, EXTENSION_TABLE, TABLE_QUANTILES)
+    with stage('binning', total_count):
+        chart_counts = {spec: cube.histogram(spec.column_for(dr_range), cells) for spec in CHART_SPECS}
+    return total_count, tile_stats, chart_counts
+
+
+def filtered_results(df, filter_index, dr_range, selections, windows=None, value_ranges=None):
+    """Results of `selections` and slider `windows` over the raw rows."""
+    with stage('filter', len(df)) as filtered:
+        rows = select_rows(filter_index, selections, windows)
+        filtered.rows_out = len(rows)
+    # Tiles and charts only read the retracement/extension columns
+    return rows_results(gather(df, rows, std_columns(dr_range)), dr_range, value_ranges)
+
+
+def time_results(df, filter_index, dr_range, selections, windows=None, bucket_minutes=5, value_ranges=None):
+    """{spec: (counts, labels)} of the confirmation time charts in `bucket_minutes` buckets.
+
+    Times are integer seconds, so this is one gather of two columns and a bincount each.
+    """
+    value_ranges = value_ranges or {}
+    with stage('filter', len(df)) as filtered:
+        rows = select_rows(filter_index, selections, windows)
+        filtered.rows_out = len(rows)
+    specs = [replace(spec, bin_width=bucket_minutes) for spec in TIME_CHART_SPECS]
+    with stage('binning', len(rows)):
+        times = gather(df, rows, [spec.column_for(dr_range) for spec in specs])
+        return {spec: time_histogram(spec, times, dr_range, value_ranges.get(spec.column_for(dr_range)))
+                for spec in specs}
+
+
+def _number(value):
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+def summarize_results(dr_range, total_count, tile_stats, chart_counts):
+    """JSON-ready form of one view's results: session count, tile stats and chart buckets."""
+    tiles = {}
+    for (kind, measure), stats in tile_stats.items():
+        tiles[f'{kind} {measure}'] = {
+            side: {f'{key:g}': _number(value) for key, value in stats[side].items()}
+            for side in ('at_most', 'at_least', 'quantiles') if stats[side]
+        }
+    charts = {}
+    for spec, (counts, labels) in chart_counts.items():
+        charts[spec.column_for(dr_range)] = {'labels': list(labels), 'counts': [int(c) for c in counts]}
+    return {'sessions': int(total_count), 'tiles': tiles, 'charts': charts}
+
+
+def view_results(df, dr_range, selections, windows=None, value_ranges=None, filter_index=None):
+    """Summary of one dashboard view over `df`; the sliders default to their full dataset ranges."""
+    value_ranges = value_ranges or column_ranges(df)
+    windows = full_windows(value_ranges, dr_range) if windows is None else windows
+    filter_index = filter_index or FilterIndex(df)
+    return summarize_results(dr_range, *filtered_results(df, filter_index, dr_range, selections, windows,
+                                                         value_ranges))
@@ -1,137 +1,181 @@
+import functools
+import logging
+import os
+import uuid
+
 import streamlit as st
 import pandas as pd
-import numpy as np
-import plotly.express as px
-
-st.set_page_config(layout='wide')
-
-def dynamic_binning(df, col_name, bin_width=0.25):
-    if col_name not in df or df[col_name].dropna().empty:
-        return None, []  # Return None and an empty list if the column doesn't exist or is empty
-
-    col_min = df[col_name].min(skipna=True)
-    col_max = df[col_name].max(skipna=True)
-
-    # Round min/max to nearest bin width
-    col_min = bin_width * np.floor(col_min / bin_width)
-    col_max = bin_width * np.ceil(col_max / bin_width)
-
-    # Create bins explicitly in increments of bin_width
-    bins = np.arange(col_min, col_max + bin_width, bin_width)
-
-    # Generate labels dynamically with correct formatting
-    labels = []
-    for i in range(len(bins) - 1):
-        lower, upper = bins[i], bins[i + 1] - 0.001  # Adjust upper bound for correct naming
-        labels.append(f"{lower:.3f} to {upper:.3f}")
-
-    # Apply binning to the column
-    categorized_column = pd.cut(df[col_name], bins=bins, labels=labels, include_lowest=True)
-
-    return categorized_column, labels  # Return labels in descending order (from high to low)
-
-# ✅ Store username-password pairs
-USER_CREDENTIALS = {
-    "amer": "NQ",
-    "nick": "NQ",
-    "tucker": "gamma",
-    "armando": "ES"
-}
 
-# ✅ Initialize session state for authentication
-if "authenticated" not in st.session_state:
-    st.session_state["authenticated"] = False
-if "username" not in st.session_state:
-    st.session_state["username"] = None
-
-# ✅ Login form (only shown if not authenticated)
-if not st.session_state["authenticated"]:
-    st.title("Login to M7Box Database")
+from analysis import cube_results, filtered_results, gather, make_selections, select_rows, time_results, window_cube
+from charts import CHART_SPECS, TIME_BUCKETS, chart_from_counts
+from clock import clock_seconds, clock_time
+from compare import comparison_figure, comparison_table, common_range, full_windows, group_name, map_selections
+from cube import SegmentedCube
+from filters import FilterIndex, SegmentedFilterIndex
+from ingest import concat_chunks, content_hash, path_signature, read_csv_bytes, read_csv_path
+from metrics import threshold_table
+from profiling import recent_reruns, rerun, stage, stage_percentiles, stage_table
+from query import PandasBackend, get_backend
+from result_cache import ResultCache, normalize_selections
+from schema import DAYS, DR_RANGES, MID_BROKEN_COLUMNS, categorical_columns, columns_for
+from store import (append_dataset, column_ranges, compact_dataset, list_datasets, list_instruments,
+                   partition_segments, read_column_ranges, read_meta, read_segment, save_dataset)
+from surface import HIT_TARGETS, build_surface, surface_figure
+from whatif import IMPACT_TARGETS, filter_impacts, target_label
 
-    # Username and password fields
-    username = st.text_input("Username:")
-    password = st.text_input("Password:", type="password")
-
-    # Submit button
-    if st.button("Login"):
-        if username in USER_CREDENTIALS and password == USER_CREDENTIALS[username]:
-            st.session_state["authenticated"] = True
-            st.session_state["username"] = username  # Store the username
-            st.success(f"Welcome, {username}! Redirecting...")
-            st.rerun()  # Refresh to load the dashboard
-        else:
-            st.error("Incorrect username or password. Please try again.")
-
-    # Stop execution if user is not authenticated
-    st.stop()
-
-# ✅ If authenticated, show the full app
-st.sidebar.success(f"Logged in as: **{st.session_state['username']}**")
-st.title("M7Box Database")
-
-# ✅ Logout button in the sidebar
-if st.sidebar.button("Logout"):
-    st.session_state["authenticated"] = False
-    st.session_state["username"] = None
-    st.rerun()
-
-# Upload CSV File
-uploaded_file = st.file_uploader("Upload a CSV file", type=["csv"])
-
-if uploaded_file is not None:
-    df = pd.read_csv(uploaded_file)
-
-    df['ODR_M7Box_Confirmation_Time_NY'] = pd.to_datetime(df['ODR_M7Box_Confirmation_Time_NY'], errors='coerce').dt.time
-    df['ODR_DR_Confirmation_Time_NY'] = pd.to_datetime(df['ODR_DR_Confirmation_Time_NY'], errors='coerce').dt.time
-    df['RDR_M7Box_Confirmation_Time_NY'] = pd.to_datetime(df['RDR_M7Box_Confirmation_Time_NY'], errors='coerce').dt.time
-    df['RDR_DR_Confirmation_Time_NY'] = pd.to_datetime(df['RDR_DR_Confirmation_Time_NY'], errors='coerce').dt.time
+st.set_page_config(layout='wide')
 
-    ### **Sidebar: Select Instrument and DR Range**
-    instrument_options = df['Instrument'].dropna().unique().tolist()
-    selected_instrument = st.sidebar.selectbox("Select Instrument", instrument_options)
-    dr_range_options = ['ODR', 'RDR']
-    selected_dr_range = st.sidebar.selectbox("Select DR Range", dr_range_options)
-    day_options = ['All'] + ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
-    selected_day = st.sidebar.selectbox("Day of Week", day_options)
+# ✅ Parse each upload once, keyed on its content hash. Old uploads are evicted after an hour
+# or once more than 8 are held.
+# ✅ Frames are cached as resources: every session gets the same process-wide object instead of
+# its own unpickled copy, and is expected to treat it as read-only. Copy-on-write, always on from
+# pandas 3 (hence the pin in requirements.txt), makes the arrays behind it read-only views to
+# anyone reaching them through the public API.
+@st.cache_resource(max_entries=8, ttl=3600, show_spinner="Parsing CSV...")
+def load_dataset(file_hash, _data):
+    return read_csv_bytes(_data)
+
+@st.cache_data(max_entries=8, ttl=3600)
+def load_column_ranges(file_hash, _df):
+    return column_ranges(_df)
+
+# ✅ Saved datasets are read one segment file at a time, keyed on their save time so re-saving
+# under the same name invalidates them. Appending sessions only adds segments to read.
+@st.cache_resource(max_entries=64, ttl=3600)
+def load_saved_segment(name, saved_at, instrument, dr_range, file_name):
+    with stage('read_segment') as loaded:
+        segment = read_segment(name, file_name, columns=columns_for(dr_range))
+        loaded.rows_out = len(segment)
+    return segment
+
+@st.cache_resource(max_entries=16, ttl=3600)
+def join_segments(data_key, _segments):
+    return concat_chunks(_segments)
+
+# ✅ The filter index is read-only, so one copy per segment is shared by every session using it
+@st.cache_resource(max_entries=64, ttl=3600)
+def load_filter_index(segment_key, _df):
+    with stage('build_filter_index', len(_df)):
+        return FilterIndex(_df)
+
+# ✅ Aggregates of one segment's rows inside the default slider windows. Appended segments reuse
+# the first segment's quantile blocks so their cubes can be queried together.
+@st.cache_resource(max_entries=64, ttl=3600)
+def load_cube(segment_key, base_key, dr_range, default_windows, _df, _filter_index, _block_edges):
+    return window_cube(_df, _filter_index, dr_range, dict(default_windows), _block_edges)
+
+# ✅ Option lists only change with the data, so they're built once per dataset and DR range
+@st.cache_data(max_entries=64, ttl=3600)
+def load_filter_options(data_key, dr_range, _df):
+    with stage('filter_options', len(_df)):
+        return {col: _df[col].dropna().unique().tolist() for col in categorical_columns(dr_range) + MID_BROKEN_COLUMNS}
+
+# ✅ One result cache for the whole server process
+@st.cache_resource
+def get_result_cache():
+    return ResultCache()
+
+# ✅ Saved datasets can be queried in place by another engine (M7BOX_QUERY_BACKEND=duckdb)
+@st.cache_resource
+def get_query_backend():
+    try:
+        return get_backend()
+    except ValueError as e:
+        # ✅ A misconfigured server (unknown backend, duckdb not installed) still serves every view
+        logging.getLogger(__name__).warning("%s Falling back to the pandas backend.", e)
+        return PandasBackend()
+
+def load_view(source, instrument, dr_range, upload=None):
+    """Segment keys, segment frames, joined frame and filter index behind one instrument and DR range.
+
+    An upload is a single frame holding every instrument; saved datasets are read per instrument.
+    """
+    if upload is not None:
+        file_hash, full_df = upload
+        keys, frames, df = [file_hash], [full_df], full_df
+    else:
+        # Only the selected instrument's partition and the selected range's columns are read
+        meta = read_meta(source)
+        keys = [(source, meta['saved_at'], instrument, dr_range, segment['file'])
+                for segment in partition_segments(meta, instrument)]
+        frames = [load_saved_segment(*key) for key in keys]
+        df = frames[0] if len(frames) == 1 else join_segments(tuple(keys), frames)
+    filter_index = SegmentedFilterIndex([load_filter_index(key, frame) for key, frame in zip(keys, frames)])
+    return keys, frames, df, filter_index
+
+def compute_results(view, dr_range, selections, slider_windows, default_windows, value_ranges):
+    """Row count, tile statistics and per-chart (counts, labels) of one selection."""
+    segment_keys, segment_frames, df, filter_index = view
+    if slider_windows == default_windows:
+        # ✅ Purely categorical selection: sum the precomputed cube cells, no raw rows touched
+        segment_cubes = []
+        for key, frame, index in zip(segment_keys, segment_frames, filter_index.segments):
+            segment_cubes.append(load_cube(key, segment_keys[0], dr_range, tuple(default_windows.items()),
+                                           frame, index, segment_cubes[0].block_edges if segment_cubes else None))
+        return cube_results(SegmentedCube(segment_cubes, value_ranges), dr_range, selections)
+    backend = get_query_backend()
+    if backend.name != 'pandas' and isinstance(segment_keys[0], tuple):
+        # ✅ One query over the stored segment files, with the filters pushed down into the scan
+        return backend.results(segment_keys[0][0], dr_range, selections, slider_windows, value_ranges)
+    # Every filter is a bitmap lookup in the precomputed index; rows are gathered once at the end.
+    # Bin edges span the whole dataset so the buckets don't move around as filters change.
+    return filtered_results(df, filter_index, dr_range, selections, slider_windows, value_ranges)
+
+def profile_context():
+    return {'session': st.session_state.get("profile_session"), 'user': st.session_state.get("username")}
+
+def profiled_fragment(func):
+    """`st.fragment` whose own reruns are profiled; inside a full rerun it is one more stage."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with rerun(func.__name__, **profile_context()), stage(func.__name__):
+            return func(*args, **kwargs)
+    return st.fragment(wrapper)
 
+######################################################
+### Filters, Tiles and Charts
+######################################################
+@profiled_fragment
+def filter_panel(view, selected_source, upload, instrument_options, selected_instrument, selected_dr_range,
+                 selected_day, dataset_ranges, filter_options, compare_mode):
+    """Filter controls and everything computed from them.
+
+    Moving a filter or slider reruns this fragment only: the login, dataset and sidebar
+    selections above it keep their last values, and the results come from the shared cache.
+    """
     ### **Main Panel: Filters Above Graph**
+    segment_keys, segment_frames, df, filter_index = view
+    data_key = tuple(segment_keys)
+
     col1, col2 = st.columns(2)
 
     with col1:
-        m7box_direction_options = ['All'] + df[f'{selected_dr_range}_M7Box_Direction'].dropna().unique().tolist()
+        m7box_direction_options = ['All'] + filter_options[f'{selected_dr_range}_M7Box_Direction']
         selected_m7box_direction = st.selectbox("M7Box Direction", m7box_direction_options)
 
-        m7box_conf_direction_options = ['All'] + df[f'{selected_dr_range}_M7Box_Confirmation_Direction'].dropna().unique().tolist()
+        m7box_conf_direction_options = ['All'] + filter_options[f'{selected_dr_range}_M7Box_Confirmation_Direction']
         selected_m7box_conf_direction = st.selectbox("M7Box Confirmation Direction", m7box_conf_direction_options)
 
-        dr_confirmation_options = ['All'] + df[f'{selected_dr_range}_DR_Confirmation_Direction'].dropna().unique().tolist()
+        dr_confirmation_options = ['All'] + filter_options[f'{selected_dr_range}_DR_Confirmation_Direction']
         selected_dr_confirmation = st.selectbox(f"DR Confirmation Direction", dr_confirmation_options)
 
     with col2:
-        dr_confirmation_valid_options = ['All'] + df[f'{selected_dr_range}_Confirmation_Valid'].dropna().unique().tolist()
+        dr_confirmation_valid_options = ['All'] + filter_options[f'{selected_dr_range}_Confirmation_Valid']
         selected_dr_confirmation_valid = st.selectbox("DR Confirmation Valid", dr_confirmation_valid_options)
 
-        m7box_confirmation_valid_options = ['All'] + df[f'{selected_dr_range}_M7Box_Confirmation_Valid'].dropna().unique().tolist()
+        m7box_confirmation_valid_options = ['All'] + filter_options[f'{selected_dr_range}_M7Box_Confirmation_Valid']
         selected_m7box_confirmation_valid = st.selectbox("M7Box Confirmation Valid", m7box_confirmation_valid_options)
 
-        dr_model_valid_options = df[f'{selected_dr_range} Model'].dropna().unique().tolist()
+        dr_model_valid_options = filter_options[f'{selected_dr_range} Model']
         selected_dr_models = st.multiselect(f"Model", ["All"] + dr_model_valid_options, default=["All"])
 
-    # Confirmtion Time
-    dr_filtered_time_values = df[f'{selected_dr_range}_DR_Confirmation_Time_NY'].dropna()
-    if not dr_filtered_time_values.empty:
-        dr_min_time = dr_filtered_time_values.min()
-        dr_max_time = dr_filtered_time_values.max()
-
-    m7box_filtered_time_values = df[f'{selected_dr_range}_M7Box_Confirmation_Time_NY'].dropna()
-    if not m7box_filtered_time_values.empty:
-        m7box_min_time = m7box_filtered_time_values.min()
-        m7box_max_time = m7box_filtered_time_values.max()
+    # Times are stored as seconds since midnight; the sliders show them as clock times
+    dr_min_time, dr_max_time = map(clock_time, dataset_ranges[f'{selected_dr_range}_DR_Confirmation_Time_NY'])
+    m7box_min_time, m7box_max_time = map(clock_time, dataset_ranges[f'{selected_dr_range}_M7Box_Confirmation_Time_NY'])
 
     # User selects a range (default: full range)
     # Get min and max absolute values (ensuring positive range)
-    min_value = df[f'{selected_dr_range} M7Box / IDR'].min()
-    max_value = df[f'{selected_dr_range} M7Box / IDR'].max()
+    min_value, max_value = dataset_ranges[f'{selected_dr_range} M7Box / IDR']
 
     col3, col4, col5 = st.columns([1, 5, 1])
 
@@ -158,11 +202,11 @@ if uploaded_file is not None:
 
     left_spacer, left_hit, right_hit, right_spacer = st.columns([1.5, 2.5, 2.5, 1.5])
     with left_hit:
-        adr_mid_hit_options = df[f'ADR Mid Broken '].dropna().unique().tolist()
+        adr_mid_hit_options = filter_options['ADR Mid Broken ']
         selected_adr_mid_hit = st.multiselect(f"ADR Mid Hit Time", ["All"] + adr_mid_hit_options, default=["All"])
 
     with right_hit:
-        odr_mid_hit_options = df[f'ODR Mid Broken '].dropna().unique().tolist()
+        odr_mid_hit_options = filter_options['ODR Mid Broken ']
         selected_odr_mid_hit = st.multiselect(f"ODR Mid Hit Time", ["All"] + odr_mid_hit_options, default=["All"])
 
     st.write("<br><br>", unsafe_allow_html=True)
@@ -170,92 +214,60 @@ if uploaded_file is not None:
 
 
     ### **Apply Filters (Only if "All" is not selected)**
-    filter_columns = [
-        ('Instrument', selected_instrument),
-        ('Day of Week', selected_day),
-        (f'{selected_dr_range}_DR_Confirmation_Direction', selected_dr_confirmation),
-        (f'{selected_dr_range}_M7Box_Confirmation_Direction', selected_m7box_conf_direction),
-        (f'{selected_dr_range}_M7Box_Direction', selected_m7box_direction),
-        (f'{selected_dr_range}_Confirmation_Valid', selected_dr_confirmation_valid),
-        (f'{selected_dr_range}_M7Box_Confirmation_Valid', selected_m7box_confirmation_valid),
-    ]
-
-    for col, val in filter_columns:
-        if val != "All":  # **Only apply filter if "None" is NOT selected**
-            df = df[df[col] == val]
-
-    # Multi-Select Filtering for RDR Model
-    if "All" not in selected_dr_models:
-        df = df[df[f'{selected_dr_range} Model'].isin(selected_dr_models)]
-
-    # Multi-Select Filtering for RDR Model
-    if "All" not in selected_adr_mid_hit:
-        df = df[df[f'ADR Mid Broken '].isin(selected_adr_mid_hit)]
-
-    # Multi-Select Filtering for RDR Model
-    if "All" not in selected_odr_mid_hit:
-        df = df[df[f'ODR Mid Broken '].isin(selected_odr_mid_hit)]
+    selections = make_selections({
+        'Instrument': selected_instrument,
+        'Day of Week': selected_day,
+        f'{selected_dr_range}_DR_Confirmation_Direction': selected_dr_confirmation,
+        f'{selected_dr_range}_M7Box_Confirmation_Direction': selected_m7box_conf_direction,
+        f'{selected_dr_range}_M7Box_Direction': selected_m7box_direction,
+        f'{selected_dr_range}_Confirmation_Valid': selected_dr_confirmation_valid,
+        f'{selected_dr_range}_M7Box_Confirmation_Valid': selected_m7box_confirmation_valid,
+        # Multi-selects: model and mid hit time
+        f'{selected_dr_range} Model': selected_dr_models,
+        'ADR Mid Broken ': selected_adr_mid_hit,
+        'ODR Mid Broken ': selected_odr_mid_hit,
+    })
 
     # Conf time and M7Box conf time filter
-    df = df[df[f'{selected_dr_range} M7Box / IDR'].between(selected_range[0], selected_range[1], inclusive='left')]
-
-    df = df[(df[f'{selected_dr_range}_M7Box_Confirmation_Time_NY'].notna()) &
-            (df[f'{selected_dr_range}_M7Box_Confirmation_Time_NY'] >= m7box_selected_time_range[0]) &
-            (df[f'{selected_dr_range}_M7Box_Confirmation_Time_NY'] < m7box_selected_time_range[1])]
-
-    df = df[(df[f'{selected_dr_range}_DR_Confirmation_Time_NY'].notna()) &
-            (df[f'{selected_dr_range}_DR_Confirmation_Time_NY'] >= dr_selected_time_range[0]) &
-            (df[f'{selected_dr_range}_DR_Confirmation_Time_NY'] < dr_selected_time_range[1])]
-
-######################################################
-### Get retracements and extensions
-######################################################
-
-    # Ensure required column is created
-    df['ODR_M7Box_Max_Retracement_STD_Quarters_Grouped'], odr_m7box_ret_custom_order = dynamic_binning(df, 'ODR_M7Box_Max_Retracement_STD', bin_width=0.25)
-    df['RDR_M7Box_Max_Retracement_STD_Quarters_Grouped'], rdr_m7Box_ret_custom_order= dynamic_binning(df, 'RDR_M7Box_Max_Retracement_STD', bin_width=0.25)
-    df['ODR_DR_Max_Retracement_STD_Quarters_Grouped'], odr_dr_ret_custom_order = dynamic_binning(df, 'ODR_DR_Max_Retracement_STD', bin_width=0.25)
-    df['RDR_DR_Max_Retracement_STD_Quarters_Grouped'], rdr_dr_ret_custom_order= dynamic_binning(df, 'RDR_DR_Max_Retracement_STD', bin_width=0.25)
-
-    df['ODR_M7Box_Max_Extension_STD_Halves_Grouped'], odr_m7box_ext_custom_order = dynamic_binning(df, 'ODR_M7Box_Max_Extension_STD', bin_width=0.5)
-    df['RDR_M7Box_Max_Extension_STD_Halves_Grouped'], rdr_m7Box_ext_custom_order= dynamic_binning(df, 'RDR_M7Box_Max_Extension_STD', bin_width=0.5)
-    df['ODR_DR_Max_Extension_STD_Halves_Grouped'], odr_dr_ext_custom_order = dynamic_binning(df, 'ODR_DR_Max_Extension_STD', bin_width=0.5)
-    df['RDR_DR_Max_Extension_STD_Halves_Grouped'], rdr_dr_ext_custom_order = dynamic_binning(df, 'RDR_DR_Max_Extension_STD', bin_width=0.5)
-
-    # Plotting columns
-    variable_column_1 = f"{selected_dr_range}_M7Box_Max_Retracement_STD_Quarters_Grouped"
-    variable_column_2 = f"{selected_dr_range}_DR_Max_Retracement_STD_Quarters_Grouped"
-    variable_column_3 = f"{selected_dr_range}_M7Box_Max_Extension_STD_Halves_Grouped"
-    variable_column_4 = f"{selected_dr_range}_DR_Max_Extension_STD_Halves_Grouped"
+    slider_windows = {
+        f'{selected_dr_range} M7Box / IDR': tuple(selected_range),
+        f'{selected_dr_range}_M7Box_Confirmation_Time_NY': tuple(map(clock_seconds, m7box_selected_time_range)),
+        f'{selected_dr_range}_DR_Confirmation_Time_NY': tuple(map(clock_seconds, dr_selected_time_range)),
+    }
+    default_windows = full_windows(dataset_ranges, selected_dr_range)
+
+    # ✅ Results are shared across sessions, keyed on the dataset and every selection
+    result_cache = get_result_cache()
+    result_key = (data_key, selected_dr_range, normalize_selections(selections), tuple(slider_windows.items()))
+    results = result_cache.get(result_key)
+
+    if results is None:
+        total_count, tile_stats, chart_counts = compute_results(view, selected_dr_range, selections, slider_windows,
+                                                                default_windows, dataset_ranges)
+        with stage('figures', total_count):
+            figures = {spec: chart_from_counts(spec, selected_dr_range, *chart_counts[spec]) for spec in CHART_SPECS}
+            results = {'total_count': total_count, 'tile_stats': tile_stats,
+                       'figures': {spec: fig.to_dict() if fig is not None else None for spec, fig in figures.items()}}
+        result_cache.put(result_key, results)
+
+    total_count, tile_stats = results['total_count'], results['tile_stats']
 
 ######################################################
 ### Metric Tiles
 ######################################################
-    total_count = len(df)
-
-    # Probability of hitting -1 (or less)
-    prob_neg_1 = df[df[f'{selected_dr_range}_M7Box_Max_Retracement_STD'] <= -1].shape[0] / total_count if total_count > 0 else 0
-    prob_pos_05 = df[df[f'{selected_dr_range}_M7Box_Max_Extension_STD'] >= 0.5].shape[0] / total_count if total_count > 0 else 0
-
-    # Probability of hitting -.25
-    median = df[f'{selected_dr_range}_M7Box_Max_Retracement_STD'].median()
-    median_ext = df[f'{selected_dr_range}_M7Box_Max_Extension_STD'].median()
+    m7box_ret, m7box_ext = tile_stats[('M7Box', 'Retracement')], tile_stats[('M7Box', 'Extension')]
+    dr_ret, dr_ext = tile_stats[('DR', 'Retracement')], tile_stats[('DR', 'Extension')]
 
-    # Probability of hitting 0
-    prob_0 = df[df[f'{selected_dr_range}_M7Box_Max_Retracement_STD'] <= 0].shape[0] / total_count if total_count > 0 else 0
-    prob_pos_1 = df[df[f'{selected_dr_range}_M7Box_Max_Extension_STD'] >= 1].shape[0] / total_count if total_count > 0 else 0
+    # Probability of hitting -1 (or less) / 0.5 (or more)
+    prob_neg_1, prob_pos_05 = m7box_ret['at_most'][-1.0], m7box_ext['at_least'][0.5]
+    prob_neg_1_dr, prob_pos_05_dr = dr_ret['at_most'][-1.0], dr_ext['at_least'][0.5]
 
-    # Probability of hitting -1 (or less)
-    prob_neg_1_dr = df[df[f'{selected_dr_range}_DR_Max_Retracement_STD'] <= -1].shape[0] / total_count if total_count > 0 else 0
-    prob_pos_05_dr = df[df[f'{selected_dr_range}_DR_Max_Extension_STD'] >= 0.5].shape[0] / total_count if total_count > 0 else 0
+    # Probability of hitting 0 (or less) / 1 (or more)
+    prob_0, prob_pos_1 = m7box_ret['at_most'][0.0], m7box_ext['at_least'][1.0]
+    prob_0_dr, prob_pos_1_dr = dr_ret['at_most'][0.0], dr_ext['at_least'][1.0]
 
-    # Probability of hitting -.25
-    median_dr = df[f'{selected_dr_range}_DR_Max_Retracement_STD'].median()
-    median_ext_dr = df[f'{selected_dr_range}_DR_Max_Extension_STD'].median()
-
-    # Probability of hitting 0
-    prob_0_dr = df[df[f'{selected_dr_range}_DR_Max_Retracement_STD'] <= 0].shape[0] / total_count if total_count > 0 else 0
-    prob_pos_1_dr = df[df[f'{selected_dr_range}_DR_Max_Extension_STD'] >= 1].shape[0] / total_count if total_count > 0 else 0
+    median, median_ext = m7box_ret['quantiles'][0.5], m7box_ext['quantiles'][0.5]
+    median_dr, median_ext_dr = dr_ret['quantiles'][0.5], dr_ext['quantiles'][0.5]
 
 
     # ✅ Step 2: Create 4 Stat Panels
@@ -285,6 +297,26 @@ if uploaded_file is not None:
         st.metric(label="Median Ret. After DR Conf.", value=f"{median_dr:.2f}")
         st.metric(label="Median Ext. After DR Conf.", value=f"{median_ext_dr:.2f}")
 
+    # ✅ Every threshold and quantile from the same sorted columns
+    with st.expander("Hit probability table"):
+        thresholds = threshold_table(tile_stats)
+        thresholds['Column'] = thresholds['Confirmation'] + ' ' + thresholds['Measure']
+        ret_table_col, ext_table_col, quantile_table_col = st.columns(3)
+        with ret_table_col:
+            st.caption("% of hitting level or lower")
+            st.dataframe(thresholds[thresholds['Hit'] == 'at most']
+                         .pivot(index='Threshold', columns='Column', values='Probability')
+                         .sort_index(ascending=False).style.format("{:.2%}"))
+        with ext_table_col:
+            st.caption("% of hitting level or higher")
+            st.dataframe(thresholds[thresholds['Hit'] == 'at least']
+                         .pivot(index='Threshold', columns='Column', values='Probability')
+                         .style.format("{:.2%}"))
+        with quantile_table_col:
+            st.caption("Quantiles")
+            st.dataframe(pd.DataFrame({f'{kind} {measure}': m['quantiles'] for (kind, measure), m in tile_stats.items()})
+                         .rename_axis('Quantile').style.format("{:.2f}"))
+
 
 ######################################################
 ### Retracement Graphs
@@ -292,226 +324,394 @@ if uploaded_file is not None:
 
     outer_col1, graph_col1, graph_col2, outer_col2 = st.columns([0.1, 11, 11, 0.1])  # Adds margin on left & right
 
-    m7box_ret_custom_order = odr_m7box_ret_custom_order if selected_dr_range == 'ODR' else rdr_m7Box_ret_custom_order
-    m7box_ext_custom_order = odr_m7box_ext_custom_order if selected_dr_range == 'ODR' else rdr_m7Box_ext_custom_order
-
-    dr_ret_custom_order = odr_dr_ret_custom_order if selected_dr_range == 'ODR' else rdr_dr_ret_custom_order
-    dr_ext_custom_order = odr_dr_ext_custom_order if selected_dr_range == 'ODR' else rdr_dr_ext_custom_order
-
-    ret_x_min = "-1.500 to -1.251"  # Leftmost bucket from image
-    ret_x_max = "0.250 to 0.499"
-
-    ext_x_min = "0.000 to 0.499"  # Leftmost bucket from image
-    ext_x_max = "5.000 to 5.499"
-
-    # First Graph with Custom Order
-    with graph_col1:
-
-        # M7Box Retracements
-        if not df.empty:
-            value_counts_df = df[variable_column_1].value_counts().reset_index()
-            value_counts_df.columns = [variable_column_1, 'count']
-            value_counts_df['percentage'] = (value_counts_df['count'] / value_counts_df['count'].sum()) * 100
-            value_counts_df['text'] = value_counts_df.apply(lambda row: f"{row['count']} ({row['percentage']:.2f}%)", axis=1)
-
-            value_counts_df[variable_column_1] = pd.Categorical(
-                value_counts_df[variable_column_1], categories=m7box_ret_custom_order, ordered=True)
-            value_counts_df = value_counts_df.sort_values(by=variable_column_1)
-
-            m7box_available_ret = [cat for cat in m7box_ret_custom_order if cat in value_counts_df[variable_column_1].unique()]
-
-            try:
-                m7box_ret_x_min_index = m7box_available_ret.index(ret_x_min)
-                m7box_ret_x_max_index = m7box_available_ret.index(ret_x_max)
-
-            except ValueError:
-                m7box_ret_x_min_index = 0
-                m7box_ret_x_max_index = len(m7box_available_ret) - 1
-
-            # Ensure correct order for range
-            m7box_ret_start_index = min(m7box_ret_x_min_index, m7box_ret_x_max_index)
-            m7box_ret_end_index = max(m7box_ret_x_min_index, m7box_ret_x_max_index)
-
-            fig1 = px.bar(
-                value_counts_df,
-                x=variable_column_1,
-                y='count',
-                text='text',
-                title=f"{selected_dr_range} M7Box Retracements After M7Box Confirmation",
-            )
-
-
-            fig1.update_layout(
-                height=500,  # Even taller graph
-                margin=dict(l=5, r=5, t=30, b=30),  # Reduce all margins
-                xaxis_tickangle=90, # Keep labels horizontal
-                xaxis=dict(
-                categoryorder="array",
-                categoryarray=m7box_ret_custom_order,  # Maintain correct ordering
-                range=[m7box_ret_start_index - 0.5, m7box_ret_end_index + 0.5],
-                tickmode="array",
-                tickvals=m7box_ret_custom_order,  # Keep all tick labels visible
-                fixedrange=False  # Allow users to pan/zoom
-)
-                )
-
-
-            fig1.update_traces(texttemplate='%{text}', textposition='outside', marker_color='#008080')
-            fig1.update_layout(yaxis_title="Count",
-                               xaxis_title='M7Box Retracements - Distribution',
-                               showlegend=False)
-
-            st.plotly_chart(fig1, use_container_width=True)
-
-            # M7Box extensions
-            value_counts_df_3 = df[variable_column_3].value_counts().reset_index()
-            value_counts_df_3.columns = [variable_column_3, 'count']
-            value_counts_df_3['percentage'] = (value_counts_df_3['count'] / value_counts_df_3['count'].sum()) * 100
-            value_counts_df_3['text'] = value_counts_df_3.apply(lambda row: f"{row['count']} ({row['percentage']:.2f}%)", axis=1)
-
-            value_counts_df_3[variable_column_3] = pd.Categorical(
-                value_counts_df_3[variable_column_3], categories=m7box_ext_custom_order, ordered=True)
-            value_counts_df_3 = value_counts_df_3.sort_values(by=variable_column_3)
-
-            m7box_available_ext = [cat for cat in m7box_ext_custom_order if cat in value_counts_df_3[variable_column_3].unique()]
-
-            try:
-                m7box_ext_x_min_index = m7box_available_ext.index(ext_x_min)
-                m7box_ext_x_max_index = m7box_available_ext.index(ext_x_max)
-
-            except ValueError:
-                m7box_ext_x_min_index = 0
-                m7box_ext_x_max_index = len(m7box_available_ext) - 1
-
-            m7box_ext_start_index = min(m7box_ext_x_min_index, m7box_ext_x_max_index)
-            m7box_ext_end_index = max(m7box_ext_x_min_index, m7box_ext_x_max_index)
-
-            fig3 = px.bar(
-                value_counts_df_3,
-                x=variable_column_3,
-                y='count',
-                text='text',
-                title=f"{selected_dr_range} M7Box Extensions After M7Box Confirmation",
-            )
-            fig3.update_layout(
-                height=500,  # Even taller graph
-                margin=dict(l=5, r=5, t=30, b=30),  # Reduce all margins
-                xaxis_tickangle=90,  # Keep labels horizontal
-                xaxis=dict(
-                categoryorder="array",
-                categoryarray=m7box_ext_custom_order,  # Maintain correct ordering
-                range=[m7box_ext_start_index - 0.5, m7box_ext_end_index + 0.5],
-                tickmode="array",
-                tickvals=m7box_ext_custom_order,  # Keep all tick labels visible
-                fixedrange=False  # Allow users to pan/zoom
-)
-            )
-            fig3.update_traces(texttemplate='%{text}', textposition='outside', marker_color='#008080')
-            fig3.update_layout(yaxis_title="Count",
-                               xaxis_title='M7Box Extensions - Distribution',
-                               showlegend=False)
-
-            st.plotly_chart(fig3, use_container_width=True)
-
-    # DR Retracements
-    with graph_col2:
-        if not df.empty:
-            value_counts_df_2 = df[variable_column_2].value_counts().reset_index()
-            value_counts_df_2.columns = [variable_column_2, 'count']
-            value_counts_df_2['percentage'] = (value_counts_df_2['count'] / value_counts_df_2['count'].sum()) * 100
-            value_counts_df_2['text'] = value_counts_df_2.apply(lambda row: f"{row['count']} ({row['percentage']:.2f}%)", axis=1)
-
-            value_counts_df_2[variable_column_2] = pd.Categorical(
-                value_counts_df_2[variable_column_2], categories=dr_ret_custom_order, ordered=True)
-            value_counts_df_2 = value_counts_df_2.sort_values(by=variable_column_2)
-
-            dr_available_ret = [cat for cat in dr_ret_custom_order if cat in value_counts_df_2[variable_column_2].unique()]
-
-            try:
-                dr_ret_x_min_index = dr_available_ret.index(ret_x_min)
-                dr_ret_x_max_index = dr_available_ret.index(ret_x_max)
-
-            except ValueError:
-                dr_ret_x_min_index = 0
-                dr_ret_x_max_index = len(dr_available_ret) - 1
-
-            dr_ret_start_index = min(dr_ret_x_min_index, dr_ret_x_max_index)
-            dr_ret_end_index = max(dr_ret_x_min_index, dr_ret_x_max_index)
-
-            fig2 = px.bar(
-                value_counts_df_2,
-                x=variable_column_2,
-                y='count',
-                text='text',
-                title=f"{selected_dr_range} M7Box Retracements After DR Confirmation",
-            )
-            fig2.update_layout(
-                height=500,  # Even taller graph
-                margin=dict(l=5, r=5, t=30, b=30),  # Reduce all margins
-                xaxis_tickangle=90,  # Keep labels horizontal
-                xaxis=dict(
-                categoryorder="array",
-                categoryarray=dr_ret_custom_order,  # Maintain correct ordering
-                range=[dr_ret_start_index - 0.5, dr_ret_end_index + 0.5],
-                tickmode="array",
-                tickvals=dr_ret_custom_order,  # Keep all tick labels visible
-                fixedrange=False  # Allow users to pan/zoom
-)
-            )
-            fig2.update_traces(texttemplate='%{text}', textposition='outside', marker_color='#008080')
-            fig2.update_layout(yaxis_title="Count",
-                               xaxis_title='M7Box Retracements - Distribution',
-                               showlegend=False)
-
-            st.plotly_chart(fig2, use_container_width=True)
-
-            # DR extensions
-            value_counts_df_4 = df[variable_column_4].value_counts().reset_index()
-            value_counts_df_4.columns = [variable_column_4, 'count']
-            value_counts_df_4['percentage'] = (value_counts_df_4['count'] / value_counts_df_4['count'].sum()) * 100
-            value_counts_df_4['text'] = value_counts_df_4.apply(lambda row: f"{row['count']} ({row['percentage']:.2f}%)", axis=1)
-
-            value_counts_df_4[variable_column_4] = pd.Categorical(
-                value_counts_df_4[variable_column_4], categories=dr_ext_custom_order, ordered=True)
-            value_counts_df_4 = value_counts_df_4.sort_values(by=variable_column_4)
-
-            dr_available_ext = [cat for cat in dr_ext_custom_order if cat in value_counts_df_4[variable_column_4].unique()]
-
-            try:
-                dr_ext_x_min_index = dr_available_ext.index(ext_x_min)
-                dr_ext_x_max_index = dr_available_ext.index(ext_x_max)
-
-            except ValueError:
-                dr_ext_x_min_index = 0
-                dr_ext_x_max_index = len(dr_available_ext) - 1
-
-            dr_ext_start_index = min(dr_ext_x_min_index, dr_ext_x_max_index)
-            dr_ext_end_index = max(dr_ext_x_min_index, dr_ext_x_max_index)
-
-            fig4 = px.bar(
-                value_counts_df_4,
-                x=variable_column_4,
-                y='count',
-                text='text',
-                title=f"{selected_dr_range} M7Box Extensions After DR Confirmation",
-            )
-            fig4.update_layout(
-                height=500,  # Even taller graph
-                margin=dict(l=5, r=5, t=30, b=30),  # Reduce all margins
-                xaxis_tickangle=90,  # Keep labels horizontal
-                xaxis=dict(
-                categoryorder="array",
-                categoryarray=dr_ext_custom_order,  # Maintain correct ordering
-                range=[dr_ext_start_index - 0.5, dr_ext_end_index + 0.5],
-                tickmode="array",
-                tickvals=dr_ext_custom_order,  # Keep all tick labels visible
-                fixedrange=False  # Allow users to pan/zoom
-)
-            )
-
-            fig4.update_traces(texttemplate='%{text}', textposition='outside', marker_color='#008080')
-            fig4.update_layout(yaxis_title="Count",
-                               xaxis_title='M7Box Extensions - Distribution',
-                               showlegend=False)
-
-            st.plotly_chart(fig4, use_container_width=True)
+    with stage('render_charts'):
+        for graph_col, specs in ((graph_col1, CHART_SPECS[:2]), (graph_col2, CHART_SPECS[2:])):
+            with graph_col:
+                if total_count > 0:
+                    for spec in specs:
+                        fig = results['figures'][spec]
+                        if fig is not None:
+                            st.plotly_chart(fig, use_container_width=True)
+
+    if total_count > 0:
+        time_chart_panel(view, selected_dr_range, selections, slider_windows, dataset_ranges)
+    impact_panel(view, selected_dr_range, selections, slider_windows, filter_options)
+    surface_panel(view, selected_dr_range, selections, slider_windows, dataset_ranges)
+    if compare_mode:
+        comparison_panel(selected_source, upload, instrument_options, selected_dr_range, selections, slider_windows,
+                         dataset_ranges)
+
+######################################################
+### Confirmation Time Graphs
+######################################################
+@profiled_fragment
+def time_chart_panel(view, selected_dr_range, selections, slider_windows, dataset_ranges):
+    """Confirmation time distributions; changing the bucket width reruns only this fragment."""
+    segment_keys, segment_frames, df, filter_index = view
+    result_cache = get_result_cache()
+
+    bucket_col, _ = st.columns([1, 5])
+    with bucket_col:
+        time_bucket = st.selectbox("Confirmation time bucket (minutes)", TIME_BUCKETS)
+
+    time_key = ('time_charts', tuple(segment_keys), selected_dr_range, normalize_selections(selections),
+                tuple(slider_windows.items()), time_bucket)
+    figures = result_cache.get(time_key)
+    if figures is None:
+        time_counts = time_results(df, filter_index, selected_dr_range, selections, slider_windows, time_bucket,
+                                   dataset_ranges)
+        with stage('figures'):
+            # One slot per spec, M7Box then DR, so an empty chart leaves its own column blank
+            figures = [None if fig is None else fig.to_dict()
+                       for fig in (chart_from_counts(spec, selected_dr_range, *counts)
+                                   for spec, counts in time_counts.items())]
+        result_cache.put(time_key, figures)
+
+    outer_col1, time_col1, time_col2, outer_col2 = st.columns([0.1, 11, 11, 0.1])
+    for time_col, fig in zip((time_col1, time_col2), figures):
+        if fig is not None:
+            with time_col:
+                st.plotly_chart(fig, use_container_width=True)
+
+######################################################
+### Filter Impact
+######################################################
+@profiled_fragment
+def impact_panel(view, selected_dr_range, selections, slider_windows, filter_options):
+    """Sessions and hit rates every option of each filter would give, the other filters unchanged.
+
+    Computed only while "Show filter impact" is on; toggling it reruns just this fragment.
+    """
+    segment_keys, segment_frames, df, filter_index = view
+    result_cache = get_result_cache()
+
+    # Filter columns and the labels of their widgets
+    impact_dimensions = {
+        'Day of Week': "Day of Week",
+        f'{selected_dr_range}_M7Box_Direction': "M7Box Direction",
+        f'{selected_dr_range}_M7Box_Confirmation_Direction': "M7Box Confirmation Direction",
+        f'{selected_dr_range}_DR_Confirmation_Direction': "DR Confirmation Direction",
+        f'{selected_dr_range}_Confirmation_Valid': "DR Confirmation Valid",
+        f'{selected_dr_range}_M7Box_Confirmation_Valid': "M7Box Confirmation Valid",
+        f'{selected_dr_range} Model': "Model",
+        'ADR Mid Broken ': "ADR Mid Hit Time",
+        'ODR Mid Broken ': "ODR Mid Hit Time",
+    }
+
+    with st.expander("Filter impact (what if)"):
+        st.caption("Sessions and hit rates each option would give, with every other filter and slider as it is now.")
+        # ✅ The expander doesn't defer its body, so the tables wait for this toggle
+        if not st.toggle("Show filter impact"):
+            return
+        impact_key = ('impact', tuple(segment_keys), selected_dr_range, normalize_selections(selections),
+                      tuple(slider_windows.items()))
+        tables = result_cache.get(impact_key)
+        if tables is None:
+            # ✅ Each filter's bitmap is built once for every dimension, then one grouped count per dimension
+            with stage('filter_impact', len(df)):
+                tables = filter_impacts(df, filter_index, selected_dr_range, list(impact_dimensions), selections,
+                                        slider_windows, {col: filter_options.get(col, DAYS) for col in impact_dimensions})
+            result_cache.put(impact_key, tables)
+
+        impact_cols = st.columns(3)
+        for i, (col, label) in enumerate(impact_dimensions.items()):
+            with impact_cols[i % 3]:
+                table = tables[col].rename(columns={col: label})
+                percent_columns = [target_label(target) for target in IMPACT_TARGETS]
+                st.dataframe(table.style.format("{:.2%}", subset=percent_columns, na_rep="–"), hide_index=True)
+
+######################################################
+### Probability Surface
+######################################################
+@profiled_fragment
+def surface_panel(view, selected_dr_range, selections, slider_windows, dataset_ranges):
+    """Surface controls rerun only this fragment; the grids are rebuilt only when the filters change."""
+    segment_keys, segment_frames, df, filter_index = view
+    data_key = tuple(segment_keys)
+    result_cache = get_result_cache()
+
+    with st.expander("Probability surface"):
+        surface_col1, surface_col2, surface_col3, surface_col4 = st.columns(4)
+        with surface_col1:
+            surface_target = st.selectbox("Hit", HIT_TARGETS, format_func=lambda target: target.label)
+            surface_time_kind = st.selectbox("Confirmation time", ['M7Box', 'DR'])
+        with surface_col2:
+            surface_time_step = st.selectbox("Time bucket (minutes)", [5, 10, 15, 30, 60], index=2)
+            surface_box_buckets = st.number_input("Box size buckets", min_value=2, max_value=100, value=20)
+        with surface_col3:
+            surface_box_width = st.slider("Box size window (buckets)", 1, int(surface_box_buckets), 1)
+            surface_time_width = st.slider("Time window (buckets)", 1, 24, 1)
+        with surface_col4:
+            surface_min_sessions = st.number_input("Min. sessions per window", min_value=1, value=10)
+            surface_shade = st.radio("Shade by", ['probability', 'sessions'], format_func=str.capitalize, horizontal=True)
+
+        # The swept columns ignore their sliders; every other filter still applies
+        surface_time_column = f'{selected_dr_range}_{surface_time_kind}_Confirmation_Time_NY'
+        surface_windows = {col: window for col, window in slider_windows.items()
+                           if col not in (f'{selected_dr_range} M7Box / IDR', surface_time_column)}
+        surface_key = ('surface', data_key, selected_dr_range, normalize_selections(selections),
+                       tuple(surface_windows.items()), surface_target, surface_time_column,
+                       int(surface_box_buckets), surface_time_step)
+        surface = result_cache.get(surface_key)
+        if surface is None:
+            with stage('filter', len(df)) as filtered:
+                rows = select_rows(filter_index, selections, surface_windows)
+                filtered.rows_out = len(rows)
+            with stage('build_surface', len(rows)):
+                surface_columns = [surface_target.column_for(selected_dr_range), f'{selected_dr_range} M7Box / IDR',
+                                   surface_time_column]
+                surface = build_surface(gather(df, rows, surface_columns), selected_dr_range, surface_target,
+                                        surface_time_column, dataset_ranges[f'{selected_dr_range} M7Box / IDR'],
+                                        dataset_ranges[surface_time_column], int(surface_box_buckets),
+                                        surface_time_step)
+            result_cache.put(surface_key, surface)
+
+        # Every window is four prefix-sum lookups, so resizing the window never touches the rows
+        time_width = min(surface_time_width, surface.shape[1])
+        with stage('surface_figure'):
+            st.plotly_chart(surface_figure(surface, int(surface_box_width), time_width, int(surface_min_sessions),
+                                           f"{selected_dr_range} {surface_target.label} by Box Size and "
+                                           f"{surface_time_kind} Confirmation Time", surface_shade),
+                            use_container_width=True)
+
+######################################################
+### Instrument × DR Range Comparison
+######################################################
+@profiled_fragment
+def comparison_panel(source, upload, instrument_options, selected_dr_range, selections, slider_windows,
+                     dataset_ranges):
+    """Every instrument × DR range under the current filters."""
+    st.subheader("Instrument × DR Range Comparison")
+    result_cache = get_result_cache()
+    default_windows = full_windows(dataset_ranges, selected_dr_range)
+    # Charts of the same measure share their buckets across DR ranges
+    compare_ranges = {spec.column_for(r): common_range(dataset_ranges, [spec.column_for(other) for other in DR_RANGES])
+                      for spec in CHART_SPECS for r in DR_RANGES}
+    with stage('load_views'):
+        views = {(inst, r): load_view(source, inst, r, upload) for r in DR_RANGES for inst in instrument_options}
+    compare_key = ('compare', tuple(tuple(v[0]) for v in views.values()), selected_dr_range,
+                   normalize_selections(selections), tuple(slider_windows.items()))
+    comparison = result_cache.get(compare_key)
+
+    if comparison is None:
+        # Every group is a cube lookup (or one filter-index pass when the sliders are moved)
+        stats_by_group, counts_by_group, chart_counts_by_group = {}, {}, {}
+        for r in DR_RANGES:
+            range_windows = full_windows(dataset_ranges, r)
+            for inst in instrument_options:
+                group = group_name(inst, r)
+                group_selections = {**map_selections(selections, selected_dr_range, r), 'Instrument': [inst]}
+                counts_by_group[group], stats_by_group[group], chart_counts_by_group[group] = compute_results(
+                    views[(inst, r)], r, group_selections,
+                    slider_windows if r == selected_dr_range else range_windows, range_windows, compare_ranges)
+        with stage('figures'):
+            figures = {spec: comparison_figure(spec, DR_RANGES, {group: counts[spec]
+                                                                 for group, counts in chart_counts_by_group.items()})
+                       for spec in CHART_SPECS}
+            comparison = {'table': comparison_table(stats_by_group, counts_by_group),
+                          'figures': {spec: fig.to_dict() if fig is not None else None
+                                      for spec, fig in figures.items()}}
+        result_cache.put(compare_key, comparison)
+
+    if slider_windows != default_windows:
+        st.caption(f"Slider windows only apply to the {selected_dr_range} rows; the other DR range uses its full windows.")
+    percent_columns = [col for col in comparison['table'].columns if col.startswith('%')]
+    median_columns = [col for col in comparison['table'].columns if col.startswith('Median')]
+    st.dataframe(comparison['table'].style.format("{:.2%}", subset=percent_columns)
+                 .format("{:.2f}", subset=median_columns))
+
+    compare_col1, compare_col2 = st.columns(2)
+    for compare_col, specs in ((compare_col1, CHART_SPECS[:2]), (compare_col2, CHART_SPECS[2:])):
+        with compare_col:
+            for spec in specs:
+                if comparison['figures'][spec] is not None:
+                    st.plotly_chart(comparison['figures'][spec], use_container_width=True)
+
+######################################################
+### Result Cache
+######################################################
+@st.fragment
+def cache_panel():
+    """Size and hit rate of the shared result cache; drawn by the full run, outside the filter fragments."""
+    with st.expander("Result cache"):
+        # Reruns only this panel, so lookups made by fragment reruns show up too
+        st.button("Refresh", key="refresh_cache")
+        cache_stats = get_result_cache().stats()
+        st.caption(f"{cache_stats['entries']} entries, {cache_stats['bytes'] / 2**20:.1f} of "
+                   f"{cache_stats['max_bytes'] / 2**20:.0f} MB")
+        st.caption(f"Hits: {cache_stats['hits']} · Misses: {cache_stats['misses']} · "
+                   f"Evictions: {cache_stats['evictions']} · Hit rate: {cache_stats['hit_rate']:.1%}")
+
+######################################################
+### Profiling (admins only)
+######################################################
+@st.fragment
+def profiling_panel(session):
+    """Stage timings of this session's last rerun and latency percentiles across the server process."""
+    with st.expander("Profiling"):
+        # Reruns only this panel, so fragment reruns since the last full rerun show up too
+        st.button("Refresh", key="refresh_profiling")
+        reruns = recent_reruns()
+        own_reruns = [profile for profile in reruns if profile.session == session]
+        if own_reruns:
+            last = own_reruns[-1]
+            memory = f", memory Δ {last.rss_delta / 2**20:+.1f} MB" if last.rss_delta is not None else ""
+            st.caption(f"Last rerun ({last.trigger}): {last.seconds * 1000:.0f} ms{memory}")
+            st.dataframe(stage_table(last).style.format({'ms': "{:.1f}"}, na_rep=""), hide_index=True)
+        if reruns:
+            st.caption(f"Latency percentiles over the last {len(reruns)} reruns, every session")
+            st.dataframe(stage_percentiles([record for profile in reruns for record in profile.records()])
+                         .style.format("{:.1f}"))
+
+# ✅ Store username-password pairs
+USER_CREDENTIALS = {
+    "amer": "NQ",
+    "nick": "NQ",
+    "tucker": "gamma",
+    "armando": "ES"
+}
+
+# ✅ Users who see the profiling panel
+ADMIN_USERS = {"tucker"}
+
+# ✅ Initialize session state for authentication
+if "authenticated" not in st.session_state:
+    st.session_state["authenticated"] = False
+if "username" not in st.session_state:
+    st.session_state["username"] = None
+if "profile_session" not in st.session_state:
+    st.session_state["profile_session"] = uuid.uuid4().hex[:12]
+
+# ✅ Login form (only shown if not authenticated)
+if not st.session_state["authenticated"]:
+    st.title("Login to M7Box Database")
+
+    # Username and password fields
+    username = st.text_input("Username:")
+    password = st.text_input("Password:", type="password")
+
+    # Submit button
+    if st.button("Login"):
+        if username in USER_CREDENTIALS and password == USER_CREDENTIALS[username]:
+            st.session_state["authenticated"] = True
+            st.session_state["username"] = username  # Store the username
+            st.success(f"Welcome, {username}! Redirecting...")
+            st.rerun()  # Refresh to load the dashboard
+        else:
+            st.error("Incorrect username or password. Please try again.")
+
+    # Stop execution if user is not authenticated
+    st.stop()
+
+# ✅ If authenticated, show the full app
+st.sidebar.success(f"Logged in as: **{st.session_state['username']}**")
+st.title("M7Box Database")
+
+# ✅ Logout button in the sidebar
+if st.sidebar.button("Logout"):
+    st.session_state["authenticated"] = False
+    st.session_state["username"] = None
+    st.rerun()
+
+# ✅ Time every stage of this rerun; fragments rerunning on their own are profiled separately. The profile
+# is logged however the rerun ends, including st.rerun() and exceptions.
+with rerun('full', **profile_context()):
+    # ✅ Pick a saved dataset or upload a new CSV
+    UPLOAD_OPTION = "Upload a CSV file"
+    IMPORT_OPTION = "Import CSVs from a server path"
+    selected_source = st.sidebar.selectbox("Dataset", [UPLOAD_OPTION, IMPORT_OPTION] + list_datasets())
+    instrument_options = None
+
+    if selected_source == UPLOAD_OPTION:
+        uploaded_file = st.file_uploader("Upload a CSV file", type=["csv"])
+
+        if uploaded_file is not None:
+            file_bytes = uploaded_file.getvalue()
+            with stage('load_upload') as loaded:
+                file_hash = content_hash(file_bytes)
+                try:
+                    full_df = load_dataset(file_hash, file_bytes)
+                except ValueError as e:
+                    st.error(str(e))
+                    st.stop()
+                loaded.rows_out = len(full_df)
+            instrument_options = full_df['Instrument'].dropna().unique().tolist()
+
+            # Save the parsed upload to the library so later sessions can skip the upload
+            with st.sidebar.form("save_dataset"):
+                dataset_name = st.text_input("Save as", value=uploaded_file.name.rsplit('.', 1)[0])
+                if st.form_submit_button("Save to library"):
+                    try:
+                        saved_name = save_dataset(full_df, dataset_name, source_hash=file_hash)
+                        st.success(f"Saved as **{saved_name}**")
+                    except ValueError as e:
+                        st.error(str(e))
+
+            # Or add the upload's sessions to a dataset already in the library
+            saved_datasets = list_datasets()
+            if saved_datasets:
+                with st.sidebar.form("append_dataset"):
+                    append_target = st.selectbox("Append to", saved_datasets)
+                    if st.form_submit_button("Append to dataset"):
+                        try:
+                            appended = append_dataset(full_df, append_target, source_hash=file_hash)
+                            st.success(f"Appended {appended:,} rows to **{append_target}**")
+                        except ValueError as e:
+                            st.error(str(e))
+    elif selected_source == IMPORT_OPTION:
+        # Large exports are read from the server's disk in chunks, so the uploader size cap doesn't apply
+        with st.form("import_path"):
+            import_path = st.text_input("CSV file or directory of CSVs on the server")
+            import_name = st.text_input("Save as")
+            if st.form_submit_button("Import"):
+                progress_bar = st.progress(0.0, text="Reading CSVs...")
+                try:
+                    with stage('import_csv') as imported:
+                        imported_df = read_csv_path(
+                            import_path, progress=lambda fraction, rows: progress_bar.progress(fraction, text=f"{rows:,} rows read"))
+                        imported.rows_out = len(imported_df)
+                    saved_name = save_dataset(imported_df, import_name or os.path.basename(os.path.normpath(import_path)),
+                                              source_hash=path_signature(import_path))
+                    st.success(f"Imported {len(imported_df):,} rows as **{saved_name}**. Pick it from the Dataset list.")
+                except (ValueError, OSError) as e:
+                    st.error(str(e))
+    else:
+        instrument_options = list_instruments(selected_source)
+
+        # Every append adds a segment file per instrument; compacting folds them back into one
+        source_meta = read_meta(selected_source)
+        n_segments = max(len(partition_segments(source_meta, inst)) for inst in source_meta['partitions'])
+        if n_segments > 1 and st.sidebar.button(f"Compact appended sessions ({n_segments} segments)"):
+            compact_dataset(selected_source)
+            st.rerun()
+
+    if instrument_options is not None:
+        ### **Sidebar: Select Instrument and DR Range**
+        selected_instrument = st.sidebar.selectbox("Select Instrument", instrument_options)
+        dr_range_options = ['ODR', 'RDR']
+        selected_dr_range = st.sidebar.selectbox("Select DR Range", dr_range_options)
+        day_options = ['All'] + ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
+        selected_day = st.sidebar.selectbox("Day of Week", day_options)
+
+        compare_mode = st.sidebar.toggle("Compare instruments and DR ranges")
+
+        upload = (file_hash, full_df) if selected_source == UPLOAD_OPTION else None
+        with stage('load_view') as loaded:
+            view = load_view(selected_source, selected_instrument, selected_dr_range, upload)
+            loaded.rows_out = len(view[2])
+        filter_options = load_filter_options(tuple(view[0]), selected_dr_range, view[2])
+
+        # Confirmtion Time and Box Size slider bounds span the whole dataset, not just the loaded partition
+        if selected_source == UPLOAD_OPTION:
+            dataset_ranges = load_column_ranges(file_hash, full_df)
+        else:
+            dataset_ranges = read_column_ranges(selected_source)
+
+        filter_panel(view, selected_source, upload, instrument_options, selected_instrument, selected_dr_range,
+                     selected_day, dataset_ranges, filter_options, compare_mode)
+        with st.sidebar:
+            cache_panel()
+
+if st.session_state["username"] in ADMIN_USERS:
+    with st.sidebar:
+        profiling_panel(st.session_state["profile_session"])
@@ -0,0 +1,180 @@
+"""Benchmark the dashboard pipeline on synthetic exports of increasing size.
+
+Every stage the dashboard runs (CSV ingestion, the filter index and filter chain, binning,
+tile metrics, the aggregate cube and figure construction) is timed at each size, and one
+JSON line per stage is appended to the results file together with the commit it ran on, so
+runs can be compared across commits:
+
+    python benchmark.py                      # 10k, 1M and 10M rows
+    python benchmark.py --sizes 10000 200000
+    python benchmark.py --report             # rows/s per stage and size, one column per commit
+
+Generated CSVs are kept in --data-dir and reused by later runs.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+
+import numpy as np
+import pandas as pd
+
+from binning import dynamic_binning
+from charts import CHART_SPECS, build_chart
+from cube import SegmentedCube, build_cube
+from filters import FilterIndex
+from ingest import read_csv_path
+from metrics import tile_metrics
+from profiling import PeakRSS
+from schema import time_columns
+from store import column_ranges
+from synthetic import write_csv
+
+DEFAULT_SIZES = [10_000, 1_000_000, 10_000_000]
+DEFAULT_RESULTS = 'benchmark_results.jsonl'
+DEFAULT_DATA_DIR = '.benchmark'
+DR_RANGE = 'RDR'
+
+
+def _commit():
+    try:
+        root = os.path.dirname(os.path.abspath(__file__))
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def _selection(df, filter_index):
+    """The filter chain of a typical view: one instrument, a direction, two models, middle half of each slider.
+
+    The middle half is the 25th to 75th percentile, so the view keeps a share of the rows that
+    doesn't depend on how skewed a column is.
+    """
+    r = DR_RANGE
+    selections = {
+        'Instrument': [df['Instrument'].cat.categories[0]],
+        f'{r}_M7Box_Direction': ['Long'],
+        f'{r} Model': list(df[f'{r} Model'].cat.categories[:2]),
+    }
+    selection = filter_index.everything()
+    for col, values in selections.items():
+        selection &= filter_index.match(col, values)
+    for col in [f'{r} M7Box / IDR'] + time_columns(r):
+        lo, hi = df[col].quantile([0.25, 0.75])
+        selection &= filter_index.in_range(col, lo, hi)
+    return df.iloc[filter_index.rows(selection)], selections
+
+
+def _instrument_rows(df, filter_index):
+    """Every row of one instrument: the largest view the dashboard shows without a filter."""
+    return df.iloc[filter_index.rows(filter_index.match('Instrument', [df['Instrument'].cat.categories[0]]))]
+
+
+def run_size(n_rows, data_dir, seed):
+    """Time every stage on `n_rows` rows; yields (stage, seconds, rows_in, rows_out, PeakRSS)."""
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f'synthetic_{n_rows}_{seed}.csv')
+    if not os.path.exists(path):
+        with PeakRSS() as memory:
+            start = time.perf_counter()
+            write_csv(path + '.tmp', n_rows, seed)
+            os.replace(path + '.tmp', path)
+        yield 'generate', time.perf_counter() - start, 0, n_rows, memory
+
+    def timed(stage, rows_in, func, count=None):
+        """Run `func` once; `count(result)` gives the rows out, otherwise every row goes through."""
+        with PeakRSS() as memory:
+            start = time.perf_counter()
+            result = func()
+            seconds = time.perf_counter() - start
+        return result, (stage, seconds, rows_in, count(result) if count else rows_in, memory)
+
+    df, row = timed('ingest', n_rows, lambda: read_csv_path(path), len)
+    yield row
+    ranges = column_ranges(df)
+
+    filter_index, row = timed('filter_index', len(df), lambda: FilterIndex(df))
+    yield row
+    (filtered, selections), row = timed('filter', len(df), lambda: _selection(df, filter_index),
+                                        lambda result: len(result[0]))
+    yield row
+
+    # Per-view stages on the filtered view, then on a whole instrument so their scaling shows
+    for suffix, view in (('', filtered), ('_instrument', _instrument_rows(df, filter_index))):
+        _, row = timed('binning' + suffix, len(view), lambda: [
+            dynamic_binning(view, spec.column_for(DR_RANGE), spec.bin_width, ranges.get(spec.column_for(DR_RANGE)))
+            for spec in CHART_SPECS])
+        yield row
+        _, row = timed('tiles' + suffix, len(view), lambda: tile_metrics(view, DR_RANGE))
+        yield row
+        _, row = timed('figures' + suffix, len(view), lambda: [
+            build_chart(spec, view, DR_RANGE, ranges.get(spec.column_for(DR_RANGE))).to_json() for spec in CHART_SPECS])
+        yield row
+
+    cube, row = timed('cube_build', len(df), lambda: SegmentedCube([build_cube(df, DR_RANGE)], ranges))
+    yield row
+    _, row = timed('cube_query', len(df), lambda: [cube.column(f'{DR_RANGE}_M7Box_Max_Retracement_STD',
+                                                               cube.select(selections)).quantiles([0.5])])
+    yield row
+
+
+def run(sizes, results_path, data_dir, seed):
+    commit, dirty = _commit()
+    context = {
+        'commit': commit, 'dirty': dirty, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+        'machine': platform.machine(), 'cpus': os.cpu_count(),
+    }
+    with open(results_path, 'a') as results:
+        for n_rows in sizes:
+            for stage, seconds, rows_in, rows_out, memory in run_size(n_rows, data_dir, seed):
+                record = {
+                    **context, 'rows': n_rows, 'stage': stage, 'seconds': round(seconds, 6),
+                    'rows_in': rows_in, 'rows_out': rows_out,
+                    'rows_per_second': round(max(rows_in, rows_out) / seconds) if seconds > 0 else None,
+                    'peak_rss_mb': round(memory.peak / 2**20, 1) if memory.start is not None else None,
+                    'rss_delta_mb': round((memory.peak - memory.start) / 2**20, 1) if memory.start is not None else None,
+                }
+                results.write(json.dumps(record) + '\n')
+                results.flush()
+                print(f"{n_rows:>12,} {stage:<20} {seconds:9.3f}s {rows_in:>12,} -> {rows_out:<12,} "
+                      f"peak {record['peak_rss_mb']} MB")
+
+
+def report(results_path, metric='rows_per_second', last=4):
+    """Latest run of each of the last `last` commits, one column per commit."""
+    results = pd.read_json(results_path, lines=True)
+    # '+' marks runs on uncommitted changes
+    results['commit'] = [f"{commit or 'unknown'}{'+' if dirty is True else ''}"
+                         for commit, dirty in zip(results['commit'].astype(object), results['dirty'].astype(object))]
+    latest = results.sort_values('timestamp').groupby(['commit', 'rows', 'stage']).last().reset_index()
+    commits = latest.sort_values('timestamp')['commit'].drop_duplicates().tolist()[-last:]
+    table = latest[latest['commit'].isin(commits)].pivot_table(index=['rows', 'stage'], columns='commit',
+                                                               values=metric, sort=False)
+    return table[commits]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard pipeline on synthetic data.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--results', default=DEFAULT_RESULTS, help="JSON-lines file the results are appended to")
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help="where generated CSVs are kept")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--report', action='store_true', help="compare the recorded runs instead of running")
+    parser.add_argument('--metric', default='rows_per_second', help="column shown by --report")
+    args = parser.parse_args()
+    if args.report:
+        with pd.option_context('display.width', 200, 'display.max_rows', None):
+            print(report(args.results, args.metric))
+    else:
+        run(args.sizes, args.results, args.data_dir, args.seed)
+
+
+if __name__ == '__main__':
+    main()
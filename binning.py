@@ -0,0 +1,89 @@
+"""Fixed-width binning of the retracement/extension STD columns and of confirmation times.
+
+Values are turned into integer bin codes with vectorized arithmetic and wrapped in a
+Categorical, so no per-row Python work happens. The label list for a given set of edges is
+built once and cached.
+"""
+import functools
+
+import numpy as np
+import pandas as pd
+
+from clock import clock_label
+
+
+def bin_bounds(col_min, col_max, bin_width):
+    """Outermost bin edges, in whole multiples of `bin_width`."""
+    lo = int(np.floor(col_min / bin_width))
+    hi = int(np.ceil(col_max / bin_width))
+    return lo, max(hi, lo + 1)  # always at least one bin, even if every value is the same
+
+
+def bin_label(lower, bin_width):
+    # Upper bound is adjusted for correct naming
+    return f"{lower:.3f} to {lower + bin_width - 0.001:.3f}"
+
+
+@functools.lru_cache(maxsize=256)
+def bin_labels(bin_width, lo, hi):
+    # Create bins explicitly in increments of bin_width
+    col_min, col_max = bin_width * lo, bin_width * hi
+    bins = np.arange(col_min, col_max + bin_width, bin_width)[:hi - lo + 1]
+    return tuple(bin_label(lower, bin_width) for lower in bins[:-1])
+
+
+def bin_codes(values, bin_width, lo, hi):
+    """Bin index of each value; -1 for missing values or values outside the edges.
+
+    Bins are closed on the right, and the first bin also holds the lowest edge.
+    """
+    values = np.asarray(values)
+    codes = np.ceil(values / bin_width) - 1 - lo
+    codes[values == bin_width * lo] = 0
+    codes[np.isnan(codes) | (codes < 0) | (codes >= hi - lo)] = -1
+    return codes.astype(np.int32)
+
+
+def bin_values(values, bin_width, value_range=None):
+    """Integer bin codes and labels for a float array.
+
+    Edges span `value_range` (min, max) when given, so bins can be pinned to the whole
+    dataset and stay the same whatever filters are applied; otherwise they span `values`.
+    """
+    values = np.asarray(values, dtype='float64')
+    if value_range is None or value_range[0] is None:
+        value_range = np.nanmin(values), np.nanmax(values)
+    lo, hi = bin_bounds(value_range[0], value_range[1], bin_width)
+    return bin_codes(values, bin_width, lo, hi), bin_labels(bin_width, lo, hi)
+
+
+def dynamic_binning(df, col_name, bin_width=0.25, value_range=None):
+    """Bin `df[col_name]` into `bin_width` wide buckets; see `bin_values` for the edges."""
+    if col_name not in df or df[col_name].dropna().empty:
+        return None, []  # Return None and an empty list if the column doesn't exist or is empty
+
+    codes, labels = bin_values(df[col_name].to_numpy(dtype='float64', na_value=np.nan), bin_width, value_range)
+    categorized_column = pd.Series(pd.Categorical.from_codes(codes, categories=labels, ordered=True),
+                                   index=df.index, name=col_name)
+    return categorized_column, list(labels)
+
+
+@functools.lru_cache(maxsize=256)
+def clock_bin_labels(step, lo, hi):
+    return tuple(f"{clock_label(b * step)}-{clock_label((b + 1) * step)}" for b in range(lo, hi))
+
+
+def clock_bin_values(seconds, bucket_minutes, value_range=None):
+    """Bucket codes and labels of times in seconds since midnight, `bucket_minutes` wide.
+
+    Buckets start on whole multiples of their width and, unlike the STD bins, are closed on
+    the left: 10:05:00 falls in 10:05-10:10. Edges span `value_range` when given.
+    """
+    step = int(bucket_minutes * 60)
+    seconds = np.asarray(seconds, dtype='float64')
+    if value_range is None or value_range[0] is None:
+        value_range = np.nanmin(seconds), np.nanmax(seconds)
+    lo, hi = int(value_range[0] // step), int(value_range[1] // step) + 1
+    codes = np.floor(seconds / step) - lo
+    codes[np.isnan(codes) | (codes < 0) | (codes >= hi - lo)] = -1
+    return codes.astype(np.int32), clock_bin_labels(step, lo, hi)
@@ -0,0 +1,131 @@
+"""Distribution charts built from integer bin codes.
+
+Counts come from one `np.bincount` over the codes and the bar text is formatted per bin, not
+per row, so a chart costs the same whatever the row count. Each chart is described by a
+`ChartSpec`; adding a distribution is a matter of adding a spec.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+from binning import bin_label, bin_values, clock_bin_values
+
+BAR_COLOR = '#008080'
+
+
+@dataclass(frozen=True)
+class ChartSpec:
+    column: str        # source column, with a {dr_range} placeholder
+    bin_width: float
+    window: tuple      # lower edges of the leftmost and rightmost buckets shown by default; None for all
+    title: str         # with a {dr_range} placeholder
+    x_title: str
+
+    def column_for(self, dr_range):
+        return self.column.format(dr_range=dr_range)
+
+
+RETRACEMENT_WINDOW = (-1.5, 0.25)
+EXTENSION_WINDOW = (0.0, 5.0)
+
+# In display order: the M7Box column of charts, then the DR column
+CHART_SPECS = [
+    ChartSpec('{dr_range}_M7Box_Max_Retracement_STD', 0.25, RETRACEMENT_WINDOW,
+              "{dr_range} M7Box Retracements After M7Box Confirmation", 'M7Box Retracements - Distribution'),
+    ChartSpec('{dr_range}_M7Box_Max_Extension_STD', 0.5, EXTENSION_WINDOW,
+              "{dr_range} M7Box Extensions After M7Box Confirmation", 'M7Box Extensions - Distribution'),
+    ChartSpec('{dr_range}_DR_Max_Retracement_STD', 0.25, RETRACEMENT_WINDOW,
+              "{dr_range} M7Box Retracements After DR Confirmation", 'M7Box Retracements - Distribution'),
+    ChartSpec('{dr_range}_DR_Max_Extension_STD', 0.5, EXTENSION_WINDOW,
+              "{dr_range} M7Box Extensions After DR Confirmation", 'M7Box Extensions - Distribution'),
+]
+
+# Confirmation time distributions; bin_width is the default bucket in minutes
+TIME_BUCKETS = [5, 10, 15, 30, 60]
+TIME_CHART_SPECS = [
+    ChartSpec('{dr_range}_M7Box_Confirmation_Time_NY', 5, None,
+              "{dr_range} M7Box Confirmation Times", 'M7Box Confirmation Time (NY)'),
+    ChartSpec('{dr_range}_DR_Confirmation_Time_NY', 5, None,
+              "{dr_range} DR Confirmation Times", 'DR Confirmation Time (NY)'),
+]
+
+
+def histogram(codes, n_bins):
+    """Count of each bin code; negative codes (missing/out of range) are dropped."""
+    return np.bincount(codes[codes >= 0], minlength=n_bins)
+
+
+def histogram_table(counts, labels):
+    """Bucket label, count, percentage and bar text for every bin, in bin order."""
+    total = counts.sum()
+    percentage = counts / total * 100 if total else np.zeros(len(counts))
+    text = np.char.add(np.char.add(counts.astype(str), ' ('), np.char.mod('%.2f%%)', percentage))
+    return pd.DataFrame({'bucket': list(labels), 'count': counts, 'percentage': percentage, 'text': text})
+
+
+def default_range(spec, labels):
+    """x-axis range covering the spec's window, or every bucket if the window isn't there."""
+    if spec.window is None:
+        return [-0.5, len(labels) - 0.5]
+    try:
+        start = labels.index(bin_label(spec.window[0], spec.bin_width))
+        end = labels.index(bin_label(spec.window[1], spec.bin_width))
+    except ValueError:
+        start, end = 0, len(labels) - 1
+    # Ensure correct order for range
+    return [min(start, end) - 0.5, max(start, end) + 0.5]
+
+
+def histogram_figure(spec, dr_range, table, labels):
+    fig = px.bar(table, x='bucket', y='count', text='text', title=spec.title.format(dr_range=dr_range))
+    fig.update_layout(
+        height=500,  # Even taller graph
+        margin=dict(l=5, r=5, t=30, b=30),  # Reduce all margins
+        xaxis_tickangle=90,
+        xaxis=dict(
+            categoryorder="array",
+            categoryarray=labels,  # Maintain correct ordering
+            range=default_range(spec, labels),
+            tickmode="array",
+            tickvals=labels,  # Keep all tick labels visible
+            fixedrange=False  # Allow users to pan/zoom
+        ),
+        yaxis_title="Count",
+        xaxis_title=spec.x_title,
+        showlegend=False,
+    )
+    fig.update_traces(texttemplate='%{text}', textposition='outside', marker_color=BAR_COLOR)
+    return fig
+
+
+def chart_from_counts(spec, dr_range, counts, labels):
+    """Figure for one spec from its per-bin counts, or None if there is nothing to plot."""
+    if counts.sum() == 0:
+        return None
+    labels = list(labels)
+    return histogram_figure(spec, dr_range, histogram_table(counts, labels), labels)
+
+
+def spec_histogram(spec, df, dr_range, value_range=None):
+    """Per-bin counts and labels of one spec over the rows of `df`."""
+    col = spec.column_for(dr_range)
+    if col not in df or df[col].isna().all():
+        return np.zeros(0, dtype=np.int64), ()
+    codes, labels = bin_values(df[col].to_numpy(dtype='float64', na_value=np.nan), spec.bin_width, value_range)
+    return histogram(codes, len(labels)), labels
+
+
+def time_histogram(spec, df, dr_range, value_range=None):
+    """Per-bucket counts and labels of one confirmation time spec; `spec.bin_width` is in minutes."""
+    col = spec.column_for(dr_range)
+    if col not in df or df[col].isna().all():
+        return np.zeros(0, dtype=np.int64), ()
+    codes, labels = clock_bin_values(df[col].to_numpy(dtype='float64', na_value=np.nan), spec.bin_width, value_range)
+    return histogram(codes, len(labels)), labels
+
+
+def build_chart(spec, df, dr_range, value_range=None):
+    """Figure for one spec over the rows of `df`."""
+    return chart_from_counts(spec, dr_range, *spec_histogram(spec, df, dr_range, value_range))
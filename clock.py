@@ -0,0 +1,38 @@
+"""Confirmation times as integer seconds since midnight NY.
+
+Times are parsed once at ingest into a nullable Int32 column, so filtering on a time window,
+min/max and binning are integer array operations rather than per-row `datetime.time`
+comparisons. `datetime.time` only appears at the edges: the slider widgets and datasets
+saved before times were stored as seconds.
+"""
+import datetime
+
+import pandas as pd
+
+TIME_DTYPE = 'Int32'
+
+
+def parse_clock(series):
+    """'HH:MM:SS' text as seconds since midnight; anything else the export might hold
+    ('HH:MM', full timestamps) is parsed separately, and unparseable values become missing."""
+    text = series.astype('string')
+    times = pd.to_datetime(text, format='%H:%M:%S', errors='coerce')
+    unparsed = times.isna() & text.notna()
+    if unparsed.any():
+        times[unparsed] = pd.to_datetime(text[unparsed], format='mixed', errors='coerce')
+    return (times.dt.hour * 3600 + times.dt.minute * 60 + times.dt.second).astype(TIME_DTYPE)
+
+
+def clock_seconds(value):
+    """Seconds since midnight of a `datetime.time`."""
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+def clock_time(seconds):
+    """`datetime.time` of a number of seconds since midnight."""
+    seconds = int(seconds)
+    return datetime.time(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def clock_label(seconds):
+    return f"{int(seconds) // 3600:02d}:{int(seconds) // 60 % 60:02d}"
@@ -0,0 +1,82 @@
+"""Side-by-side comparison of every Instrument × DR range.
+
+The filters picked for the selected DR range are carried over to the other range's
+columns, each group is answered from its own cube (or filter index), and the results are
+laid out as one table of tile metrics plus one overlaid chart per distribution.
+"""
+import pandas as pd
+import plotly.express as px
+
+from charts import default_range
+from schema import box_size_column, categorical_columns, time_columns
+
+GROUP_SEPARATOR = ' · '
+
+
+def group_name(instrument, dr_range):
+    return f'{instrument}{GROUP_SEPARATOR}{dr_range}'
+
+
+def map_selections(selections, from_range, to_range):
+    """`selections` made on `from_range`'s columns, moved onto the same columns of `to_range`."""
+    renamed = dict(zip(categorical_columns(from_range), categorical_columns(to_range)))
+    return {renamed.get(col, col): values for col, values in selections.items()}
+
+
+def full_windows(column_ranges, dr_range):
+    """Full slider windows of `dr_range`: box size, M7Box and DR confirmation time."""
+    return {col: tuple(column_ranges[col]) for col in [box_size_column(dr_range)] + time_columns(dr_range)}
+
+
+def common_range(column_ranges, columns):
+    """(min, max) over several columns, so their charts can share bins."""
+    bounds = [column_ranges[col] for col in columns if col in column_ranges and column_ranges[col][0] is not None]
+    if not bounds:
+        return None
+    return min(lo for lo, _ in bounds), max(hi for _, hi in bounds)
+
+
+def comparison_table(stats_by_group, counts_by_group):
+    """One row of tile metrics per group, with the dashboard's tile labels."""
+    rows = []
+    for group, stats in stats_by_group.items():
+        row = {'Group': group, 'Sessions': counts_by_group[group]}
+        for kind in ('M7Box', 'DR'):
+            ret, ext = stats[(kind, 'Retracement')], stats[(kind, 'Extension')]
+            row[f'% Hitting -1 After {kind} Conf.'] = ret['at_most'][-1.0]
+            row[f'% Hitting 0 After {kind} Conf.'] = ret['at_most'][0.0]
+            row[f'% Hitting 0.5 After {kind} Conf.'] = ext['at_least'][0.5]
+            row[f'% Hitting 1 After {kind} Conf.'] = ext['at_least'][1.0]
+            row[f'Median Ret. After {kind} Conf.'] = ret['quantiles'][0.5]
+            row[f'Median Ext. After {kind} Conf.'] = ext['quantiles'][0.5]
+        rows.append(row)
+    return pd.DataFrame(rows).set_index('Group')
+
+
+def comparison_figure(spec, dr_ranges, counts_by_group):
+    """Share of each group's sessions per bucket, one line per group, on shared buckets.
+
+    Shares rather than counts, so instruments with more history don't flatten the others.
+    """
+    frames = []
+    labels = []
+    for group, (counts, group_labels) in counts_by_group.items():
+        if len(group_labels) == 0 or counts.sum() == 0:
+            continue
+        labels = list(group_labels)
+        frames.append(pd.DataFrame({'bucket': labels, 'percentage': counts / counts.sum() * 100, 'group': group}))
+    if not frames:
+        return None
+    fig = px.line(pd.concat(frames, ignore_index=True), x='bucket', y='percentage', color='group', markers=True,
+                  title=spec.title.format(dr_range=' / '.join(dr_ranges)))
+    fig.update_layout(
+        height=500,
+        margin=dict(l=5, r=5, t=30, b=30),
+        xaxis_tickangle=90,
+        xaxis=dict(categoryorder="array", categoryarray=labels, range=default_range(spec, labels),
+                   tickmode="array", tickvals=labels, fixedrange=False),
+        yaxis_title="% of Sessions",
+        xaxis_title=spec.x_title,
+        legend_title_text=None,
+    )
+    return fig
@@ -0,0 +1,252 @@
+"""Aggregate cube over the categorical filter dimensions of one DR range.
+
+Rows are grouped into cells, one per observed combination of filter values (Instrument, Day
+of Week, directions, valid flags, Model, mid-broken times). Each cell keeps the statistics the
+tiles and charts need: row count, per-bin chart counts, threshold hit counts, and its STD
+values sorted with per-block counts for exact quantiles. A purely categorical selection is
+then a sum over the matching cells, and "All" on a dimension simply leaves it unconstrained.
+
+The cube only describes the rows inside the default (full) slider windows; a non-default
+slider still has to go through the raw rows.
+
+An appended dataset is a list of row segments with one cube each, queried together through a
+`SegmentedCube`. Counts add up across segments, and quantiles stay exact because appended
+segments reuse the first segment's block edges, so appending only costs a cube of the new rows.
+"""
+import numpy as np
+import pandas as pd
+
+from binning import bin_bounds, bin_codes, bin_labels
+from charts import CHART_SPECS
+from metrics import EXTENSION_TABLE, RETRACEMENT_TABLE, float_values
+from schema import filter_dimensions, std_columns
+
+QUANTILE_BLOCKS = 64
+
+
+def _dimension_codes(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy().astype(np.int32), list(series.cat.categories)
+    codes, values = pd.factorize(series)
+    return codes.astype(np.int32), list(values)
+
+
+class CubeColumn:
+    """One STD column of one or more cubes, queried over a set of cells in each.
+
+    Has the same query methods as metrics.SortedColumn, so metrics.summarize works on it.
+    Threshold probabilities are only available for the thresholds the cube was built with.
+    """
+
+    def __init__(self, parts, total):
+        self.parts = parts  # [(column stats, selected cells)], one per cube segment
+        self.total = total
+
+    def _threshold_probs(self, key, thresholds):
+        if self.total == 0:
+            return np.zeros(len(thresholds))
+        counts = sum(data[key][cells].sum(axis=0) for data, cells in self.parts)
+        index = self.parts[0][0][key + '_thresholds']
+        return np.array([counts[index[t]] for t in thresholds]) / self.total
+
+    def prob_at_most(self, thresholds):
+        return self._threshold_probs('at_most', thresholds)
+
+    def prob_at_least(self, thresholds):
+        return self._threshold_probs('at_least', thresholds)
+
+    def _kth(self, ks):
+        """The k-th smallest selected value for each k, found block by block."""
+        block_cums = [data['block_cum'][cells] for data, cells in self.parts]  # (cells, blocks), cumulative per cell
+        selected_cum = sum(block_cum.sum(axis=0) for block_cum in block_cums)
+        results = {}
+        for block in np.unique(np.searchsorted(selected_cum, ks, side='right')):
+            # Gather just this block's values from every selected cell of every segment
+            gathered = []
+            for (data, cells), block_cum in zip(self.parts, block_cums):
+                starts = data['cell_start'][cells]
+                lo = starts + (block_cum[:, block - 1] if block > 0 else 0)
+                hi = starts + block_cum[:, block]
+                lengths = hi - lo
+                gathered.append(data['values'][np.repeat(lo - np.cumsum(lengths) + lengths, lengths)
+                                               + np.arange(lengths.sum())])
+            gathered = np.concatenate(gathered)
+            gathered.sort()
+            before = selected_cum[block - 1] if block > 0 else 0
+            for k in ks[np.searchsorted(selected_cum, ks, side='right') == block]:
+                results[k] = gathered[k - before]
+        return np.array([results[k] for k in ks], dtype='float64')
+
+    def quantiles(self, qs):
+        """Linearly interpolated quantiles, identical to metrics.SortedColumn.quantiles."""
+        n = int(sum(data['block_cum'][cells, -1].sum() for data, cells in self.parts))
+        if n == 0:
+            return np.full(len(qs), np.nan)
+        pos = np.asarray(qs, dtype='float64') * (n - 1)
+        lower = np.floor(pos).astype(int)
+        upper = np.minimum(lower + 1, n - 1)
+        ks = np.unique(np.concatenate([lower, upper]))
+        kth = self._kth(ks)
+        lower_values, upper_values = kth[np.searchsorted(ks, lower)], kth[np.searchsorted(ks, upper)]
+        return lower_values + (upper_values - lower_values) * (pos - lower)
+
+
+class AggregateCube:
+    def __init__(self, df, dimensions, value_columns, chart_bins, at_most_thresholds, at_least_thresholds,
+                 block_edges=None):
+        """Aggregate every row of `df`.
+
+        `chart_bins` maps a column to the bin width of each chart to pre-bin; retracement
+        columns get `at_most_thresholds`, the others `at_least_thresholds`. `block_edges`
+        ({column: edges}) reuses another cube's quantile blocks, so the two can be queried together.
+        """
+        self.dimensions = [dim for dim in dimensions if dim in df]
+        codes, shape, self.dimension_values = [], [], {}
+        for dim in self.dimensions:
+            dim_codes, values = _dimension_codes(df[dim])
+            codes.append(dim_codes + 1)  # missing values (-1) become 0
+            shape.append(len(values) + 1)
+            self.dimension_values[dim] = {value: i for i, value in enumerate(values)}
+
+        # Each row's codes folded into one int64 key, so finding the cells is a 1-D unique
+        # rather than a much slower row-wise one; keys sort in the same order as the code rows
+        keys = np.ravel_multi_index(codes, shape) if codes else np.zeros(len(df), dtype=np.int64)
+        cell_keys, cell_of_row = np.unique(keys, return_inverse=True)
+        cell_of_row = cell_of_row.ravel()
+        self.cell_codes = (np.column_stack(np.unravel_index(cell_keys, shape)).astype(np.int32) - 1 if codes
+                           else np.zeros((len(cell_keys), 0), dtype=np.int32))
+        n_cells = len(self.cell_codes)
+        self.cell_rows = np.bincount(cell_of_row, minlength=n_cells)
+
+        # Bins span this segment's own values, starting one bin early so that no value sits on
+        # the lowest edge; `SegmentedCube.histogram` lines them up with the dataset-wide bins.
+        self.chart_bins = dict(chart_bins)
+        self.histograms = {}
+        for col, bin_width in self.chart_bins.items():
+            if col not in df:
+                continue
+            values = float_values(df[col]).astype('float64')
+            if np.isnan(values).all():
+                continue
+            lo, hi = bin_bounds(np.nanmin(values), np.nanmax(values), bin_width)
+            codes = bin_codes(values, bin_width, lo - 1, hi)
+            n_bins = hi - lo + 1
+            valid = codes >= 0
+            counts = np.bincount(cell_of_row[valid] * n_bins + codes[valid], minlength=n_cells * n_bins)
+            self.histograms[col] = (counts.reshape(n_cells, n_bins).astype(np.int32), lo - 1,
+                                    (np.nanmin(values), np.nanmax(values)))
+
+        self.columns = {}
+        self.block_edges = {}
+        for col in value_columns:
+            if col not in df:
+                continue
+            at_most = at_most_thresholds if 'Retracement' in col else []
+            at_least = [] if 'Retracement' in col else at_least_thresholds
+            self.columns[col] = self._column_stats(float_values(df[col]), cell_of_row, n_cells, at_most, at_least,
+                                                   (block_edges or {}).get(col))
+            self.block_edges[col] = self.columns[col]['edges']
+
+    @staticmethod
+    def _column_stats(values, cell_of_row, n_cells, at_most, at_least, edges=None):
+        valid = ~np.isnan(values)
+        values, cells = values[valid], cell_of_row[valid]
+
+        # Values sorted by (cell, value), so each cell's values are one sorted run
+        order = np.lexsort((values, cells))
+        values, cells = values[order], cells[order]
+        cell_start = np.searchsorted(cells, np.arange(n_cells), side='left')
+
+        # Blocks split the column's overall distribution into equal-count value ranges
+        if edges is None:
+            edges = np.quantile(values, np.linspace(0, 1, QUANTILE_BLOCKS + 1)[1:-1]) if len(values) else np.array([])
+        block = np.searchsorted(edges.astype(values.dtype), values, side='left')
+        n_blocks = len(edges) + 1
+        block_counts = np.bincount(cells * n_blocks + block, minlength=n_cells * n_blocks).reshape(n_cells, n_blocks)
+
+        def threshold_counts(thresholds, side):
+            counts = np.zeros((n_cells, len(thresholds)), dtype=np.int32)
+            for j, t in enumerate(np.asarray(thresholds, dtype=values.dtype)):
+                hit = values <= t if side == 'at_most' else values >= t
+                counts[:, j] = np.bincount(cells[hit], minlength=n_cells)
+            return counts
+
+        return {
+            'values': values,
+            'edges': edges,
+            'cell_start': cell_start,
+            'block_cum': np.cumsum(block_counts, axis=1, dtype=np.int32),
+            'at_most': threshold_counts(at_most, 'at_most'),
+            'at_most_thresholds': {t: j for j, t in enumerate(at_most)},
+            'at_least': threshold_counts(at_least, 'at_least'),
+            'at_least_thresholds': {t: j for j, t in enumerate(at_least)},
+        }
+
+    def select(self, selections):
+        """Cells matching `selections` ({dimension: [allowed values]}); absent dimensions are "All"."""
+        keep = np.ones(len(self.cell_codes), dtype=bool)
+        for dim, values in selections.items():
+            codes = [self.dimension_values[dim][v] for v in values if v in self.dimension_values[dim]]
+            keep &= np.isin(self.cell_codes[:, self.dimensions.index(dim)], codes)
+        return np.flatnonzero(keep)
+
+    def count(self, cells):
+        return int(self.cell_rows[cells].sum())
+
+    def column(self, col, cells):
+        return CubeColumn([(self.columns[col], cells)], self.count(cells))
+
+
+class SegmentedCube:
+    """Cubes of consecutive row segments (a dataset and its appends), queried as one cube.
+
+    Cells are selected per segment, so `select` returns one cell array per segment and the
+    other methods take that list back. Chart bins are laid out over `value_ranges` when given
+    ({column: (min, max)}), otherwise over every segment's values.
+    """
+
+    def __init__(self, segments, value_ranges=None):
+        self.segments = list(segments)
+        self.value_ranges = value_ranges or {}
+
+    def select(self, selections):
+        return [segment.select(selections) for segment in self.segments]
+
+    def count(self, cells):
+        return sum(segment.count(c) for segment, c in zip(self.segments, cells))
+
+    def histogram(self, col, cells):
+        parts = [(segment.histograms[col], c) for segment, c in zip(self.segments, cells) if col in segment.histograms]
+        if not parts:
+            return np.zeros(0, dtype=np.int64), ()
+        bin_width = self.segments[0].chart_bins[col]
+        value_range = self.value_ranges.get(col)
+        if value_range is None or value_range[0] is None:
+            value_range = (min(h[2][0] for h, _ in parts), max(h[2][1] for h, _ in parts))
+        lo, hi = bin_bounds(value_range[0], value_range[1], bin_width)
+
+        # One extra bin below `lo` catches values exactly on the lowest edge, which belong to
+        # the first bin; anything else outside [lo, hi) is out of range and dropped.
+        counts = np.zeros(hi - lo + 1, dtype=np.int64)
+        for (segment_counts, segment_lo, _), c in parts:
+            segment_counts = segment_counts[c].sum(axis=0)
+            start = segment_lo - (lo - 1)
+            first, last = max(-start, 0), min(len(segment_counts), len(counts) - start)
+            if first < last:
+                counts[start + first:start + last] += segment_counts[first:last]
+        counts[1] += counts[0]
+        return counts[1:], bin_labels(bin_width, lo, hi)
+
+    def column(self, col, cells):
+        parts = [(segment.columns[col], c) for segment, c in zip(self.segments, cells) if col in segment.columns]
+        return CubeColumn(parts, self.count(cells))
+
+
+def build_cube(df, dr_range, block_edges=None):
+    """The cube the dashboard uses for `dr_range`: every filter dimension, chart and table threshold.
+
+    Pass the first segment's `block_edges` when building the cube of appended rows.
+    """
+    chart_bins = {spec.column_for(dr_range): spec.bin_width for spec in CHART_SPECS}
+    return AggregateCube(df, filter_dimensions(dr_range), std_columns(dr_range), chart_bins,
+                         RETRACEMENT_TABLE, EXTENSION_TABLE, block_edges)
@@ -0,0 +1,117 @@
+"""Precomputed filter index over a loaded dataset.
+
+Every value of each categorical column gets a packed bitmap (one bit per row), and every
+range column gets a sorted index so `lo <= x < hi` resolves with two binary searches. A
+selection is then a bitwise AND of bitmaps followed by one gather of the matching rows,
+instead of a chain of filtered DataFrame copies.
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from clock import clock_seconds
+from schema import BOX_SIZE_COLUMNS, CATEGORICAL_COLUMNS, TIME_COLUMNS
+
+
+def _sort_key(value):
+    # Times are stored as seconds since midnight; a `datetime.time` bound is compared the same way
+    if isinstance(value, datetime.time):
+        return clock_seconds(value) + value.microsecond / 1e6
+    return value
+
+
+class FilterIndex:
+    def __init__(self, df, categorical_columns=CATEGORICAL_COLUMNS, range_columns=TIME_COLUMNS + BOX_SIZE_COLUMNS):
+        self.n_rows = len(df)
+        self.n_bytes = (self.n_rows + 7) // 8
+        self.value_codes = {}  # column -> {value: row of that column's bitmap table}
+        self.bitmaps = {}      # column -> (n_values, n_bytes) uint8 table
+        self.sorted_values = {}
+        self.sorted_rows = {}
+
+        for col in categorical_columns:
+            if col in df:
+                self._index_categorical(col, df[col])
+        for col in range_columns:
+            if col in df:
+                self._index_range(col, df[col])
+
+    def _index_categorical(self, col, series):
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes, values = series.cat.codes.to_numpy(), series.cat.categories
+        else:
+            codes, values = pd.factorize(series)
+        # Missing values have code -1 and so match no value's bitmap
+        bitmaps = np.empty((len(values), self.n_bytes), dtype=np.uint8)
+        for i in range(len(values)):
+            bitmaps[i] = np.packbits(codes == i)
+        self.bitmaps[col] = bitmaps
+        self.value_codes[col] = {value: i for i, value in enumerate(values)}
+
+    def _index_range(self, col, series):
+        valid = series.notna().to_numpy()
+        rows = np.flatnonzero(valid)
+        # Nullable integer columns (the times) come out as plain int arrays once missing values are dropped
+        values = series[valid].to_numpy()
+        order = np.argsort(values, kind='stable')
+        self.sorted_values[col] = values[order]
+        self.sorted_rows[col] = rows[order]
+
+    def everything(self):
+        return np.packbits(np.ones(self.n_rows, dtype=bool))
+
+    def nothing(self):
+        return np.zeros(self.n_bytes, dtype=np.uint8)
+
+    def match(self, col, values):
+        """Bitmap of rows whose `col` is any of `values`."""
+        codes = [self.value_codes[col][v] for v in values if v in self.value_codes[col]]
+        if not codes:
+            return self.nothing()
+        return np.bitwise_or.reduce(self.bitmaps[col][codes], axis=0)
+
+    def in_range(self, col, lo, hi):
+        """Bitmap of rows with `lo <= col < hi`; missing values never match."""
+        values = self.sorted_values[col]
+        start = np.searchsorted(values, _sort_key(lo), side='left')
+        stop = np.searchsorted(values, _sort_key(hi), side='left')
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[self.sorted_rows[col][start:stop]] = True
+        return np.packbits(mask)
+
+    def rows(self, bitmap):
+        """Positions of the rows set in `bitmap`, in their original order."""
+        return np.flatnonzero(np.unpackbits(bitmap, count=self.n_rows))
+
+
+class SegmentedFilterIndex:
+    """FilterIndex over several row segments laid end to end, e.g. a dataset and its appends.
+
+    Each segment keeps its own index, so appending rows only indexes the new ones. A bitmap is
+    the segments' bitmaps concatenated (each padded to whole bytes), so bitmaps combine with
+    `&` and `|` exactly as they do for a single FilterIndex.
+    """
+
+    def __init__(self, segments):
+        self.segments = list(segments)
+        self.row_offsets = np.cumsum([0] + [segment.n_rows for segment in self.segments])
+        self.byte_offsets = np.cumsum([0] + [segment.n_bytes for segment in self.segments])
+        self.n_rows = int(self.row_offsets[-1])
+        self.n_bytes = int(self.byte_offsets[-1])
+
+    def everything(self):
+        return np.concatenate([segment.everything() for segment in self.segments])
+
+    def nothing(self):
+        return np.zeros(self.n_bytes, dtype=np.uint8)
+
+    def match(self, col, values):
+        return np.concatenate([segment.match(col, values) for segment in self.segments])
+
+    def in_range(self, col, lo, hi):
+        return np.concatenate([segment.in_range(col, lo, hi) for segment in self.segments])
+
+    def rows(self, bitmap):
+        return np.concatenate([segment.rows(bitmap[start:stop]) + offset for segment, start, stop, offset
+                               in zip(self.segments, self.byte_offsets[:-1], self.byte_offsets[1:], self.row_offsets)])
@@ -0,0 +1,159 @@
+"""Parse M7Box CSV exports into a typed DataFrame.
+
+Files are read in chunks and only the columns the dashboard uses are kept, so peak memory is
+bounded by the chunk size plus the (categorical, float32) result rather than the raw file.
+A path may also be a directory of CSVs (e.g. one per month), which are read in name order.
+
+Run as a script to import CSVs into the dataset library without going through the uploader:
+
+    python ingest.py exports/2024/ nq_es_2024
+    python ingest.py exports/2025-01-06.csv nq_es_2024 --append
+"""
+import argparse
+import glob
+import hashlib
+import io
+import os
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from clock import parse_clock
+from profiling import stage
+from schema import DTYPES, TIME_COLUMNS, USED_COLUMNS, check_columns
+
+CHUNK_ROWS = 200_000
+
+
+def content_hash(data):
+    """Hash of the raw file bytes, used as the cache key for a parsed upload."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def parse_times(df):
+    with stage('parse_times', len(df)):
+        for col in TIME_COLUMNS:
+            if col in df:
+                df[col] = parse_clock(df[col])
+    return df
+
+
+def csv_files(path):
+    """The CSV files at `path`: the file itself, or every *.csv in a directory."""
+    if os.path.isdir(path):
+        files = sorted(glob.glob(os.path.join(path, '*.csv')))
+        if not files:
+            raise ValueError(f"No CSV files in {path}")
+        return files
+    if not os.path.isfile(path):
+        raise ValueError(f"{path} does not exist")
+    return [path]
+
+
+def iter_chunks(handles, chunk_rows=CHUNK_ROWS, progress=None):
+    """Yield typed, column-pruned chunks from a list of open binary file handles.
+
+    `progress(fraction, rows)` is called after every chunk, with the fraction of bytes read
+    across all handles.
+    """
+    sizes = [handle.seek(0, io.SEEK_END) for handle in handles]
+    total_bytes, done_bytes, rows = max(sum(sizes), 1), 0, 0
+    columns = None
+    for handle, size in zip(handles, sizes):
+        handle.seek(0)
+        reader = iter(pd.read_csv(handle, dtype=DTYPES, usecols=lambda col: col in USED_COLUMNS, chunksize=chunk_rows))
+        while True:
+            # Timed apart from the time parsing below, which is the other half of the ingest cost
+            with stage('read_csv') as parsed:
+                chunk = next(reader, None)
+                parsed.rows_out = 0 if chunk is None else len(chunk)
+            if chunk is None:
+                break
+            if columns is None:
+                # Only the used columns are read, so anything short of all of them is missing from the file
+                check_columns(chunk.columns, getattr(handle, 'name', 'The CSV'))
+                columns = list(chunk.columns)
+            elif set(chunk.columns) != set(columns):
+                raise ValueError(f"{getattr(handle, 'name', 'CSV')} doesn't have the same columns as the first file")
+            rows += len(chunk)
+            if progress is not None:
+                progress(min((done_bytes + handle.tell()) / total_bytes, 1.0), rows)
+            yield parse_times(chunk)
+        done_bytes += size
+
+
+def _concat_categoricals(parts):
+    # A chunk where the column is entirely empty has no categories (and a different categories
+    # dtype), so give every chunk the full category set before joining them.
+    non_empty = [part for part in parts if len(part.cat.categories)]
+    if not non_empty:
+        return pd.concat(parts, ignore_index=True)
+    categories = union_categoricals(non_empty).categories
+    return pd.Series(union_categoricals([part.cat.set_categories(categories) for part in parts]), name=parts[0].name)
+
+
+def concat_chunks(chunks):
+    """Concatenate chunks, merging the categories each chunk found on its own."""
+    chunks = list(chunks)
+    if not chunks:
+        return pd.DataFrame(columns=sorted(USED_COLUMNS))
+    with stage('concat_chunks', sum(len(chunk) for chunk in chunks)) as joined:
+        columns = {}
+        for col in chunks[0].columns:
+            parts = [chunk[col] for chunk in chunks]
+            if isinstance(parts[0].dtype, pd.CategoricalDtype):
+                columns[col] = _concat_categoricals(parts)
+            else:
+                columns[col] = pd.concat(parts, ignore_index=True)
+        joined.rows_out = joined.rows_in
+        return pd.DataFrame(columns)
+
+
+def read_csv_bytes(data, chunk_rows=CHUNK_ROWS):
+    return concat_chunks(iter_chunks([io.BytesIO(data)], chunk_rows))
+
+
+def read_csv_path(path, chunk_rows=CHUNK_ROWS, progress=None):
+    """Read a CSV file or a directory of CSVs into one typed DataFrame."""
+    handles = [open(file, 'rb') for file in csv_files(path)]
+    try:
+        return concat_chunks(iter_chunks(handles, chunk_rows, progress))
+    finally:
+        for handle in handles:
+            handle.close()
+
+
+def path_signature(path):
+    """Hash of the file names, sizes and modification times under `path`."""
+    digest = hashlib.sha256()
+    for file in csv_files(path):
+        stat = os.stat(file)
+        digest.update(f'{os.path.abspath(file)}:{stat.st_size}:{stat.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()
+
+
+def main():
+    from store import append_dataset, save_dataset
+
+    parser = argparse.ArgumentParser(description="Import M7Box CSVs into the dataset library.")
+    parser.add_argument('path', help="CSV file or directory of CSV files")
+    parser.add_argument('name', help="dataset name in the library")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--append', action='store_true', help="add the rows to an existing dataset instead of replacing it")
+    args = parser.parse_args()
+
+    def report(fraction, rows):
+        print(f"\r{fraction:6.1%}  {rows:,} rows", end='', flush=True)
+
+    df = read_csv_path(args.path, args.chunk_rows, progress=report)
+    print()
+    if args.append:
+        appended = append_dataset(df, args.name, source_hash=path_signature(args.path))
+        print(f"Appended {appended:,} rows to {args.name}")
+    else:
+        name = save_dataset(df, args.name, source_hash=path_signature(args.path))
+        print(f"Saved {len(df):,} rows as {name}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Hit probabilities and quantiles for the retracement/extension columns.
+
+Each column is sorted once; every threshold is then a binary search into the sorted values
+and every quantile an index lookup, so adding thresholds costs next to nothing.
+"""
+import numpy as np
+import pandas as pd
+
+# Default tile thresholds: retracements count rows at or below, extensions at or above
+RETRACEMENT_THRESHOLDS = [-1.0, 0.0]
+EXTENSION_THRESHOLDS = [0.5, 1.0]
+QUANTILES = [0.5]
+
+# Wider grid for the threshold table; includes every tile threshold above
+RETRACEMENT_TABLE = [i * 0.25 for i in range(-12, 1)]
+EXTENSION_TABLE = [i * 0.25 for i in range(0, 21)]
+TABLE_QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+
+
+def float_values(series):
+    """A column as a float array (keeping float32 as float32), with NaN for missing values."""
+    dtype = np.dtype(getattr(series.dtype, 'numpy_dtype', series.dtype))
+    return series.to_numpy(dtype=dtype if dtype.kind == 'f' else 'float64', na_value=np.nan)
+
+
+class SortedColumn:
+    """The non-missing values of a column, sorted, plus the row count they came from.
+
+    Probabilities are taken over every row, missing values included, which is what the
+    dashboard tiles have always shown.
+    """
+
+    def __init__(self, values, total=None):
+        values = np.asarray(values)
+        self.sorted = np.sort(values[~np.isnan(values)])
+        self.total = len(values) if total is None else total
+
+    def prob_at_most(self, thresholds):
+        if self.total == 0:
+            return np.zeros(len(thresholds))
+        thresholds = np.asarray(thresholds, dtype=self.sorted.dtype)
+        return np.searchsorted(self.sorted, thresholds, side='right') / self.total
+
+    def prob_at_least(self, thresholds):
+        if self.total == 0:
+            return np.zeros(len(thresholds))
+        thresholds = np.asarray(thresholds, dtype=self.sorted.dtype)
+        return (len(self.sorted) - np.searchsorted(self.sorted, thresholds, side='left')) / self.total
+
+    def quantiles(self, qs):
+        """Linearly interpolated quantiles (the same as pandas' default); NaN when empty."""
+        if len(self.sorted) == 0:
+            return np.full(len(qs), np.nan)
+        values = self.sorted.astype('float64')
+        pos = np.asarray(qs, dtype='float64') * (len(values) - 1)
+        lower = np.floor(pos).astype(int)
+        upper = np.minimum(lower + 1, len(values) - 1)
+        return values[lower] + (values[upper] - values[lower]) * (pos - lower)
+
+    def ecdf(self):
+        """Empirical CDF with one row per distinct value."""
+        values, first = np.unique(self.sorted, return_index=True)
+        at_most = np.append(first[1:], len(self.sorted))
+        total = max(self.total, 1)
+        return pd.DataFrame({
+            'value': values,
+            'count_at_most': at_most,
+            'prob_at_most': at_most / total,
+            'prob_at_least': (len(self.sorted) - first) / total,
+        })
+
+
+def summarize(col, at_most=(), at_least=(), quantiles=QUANTILES):
+    """{'count', 'at_most': {t: p}, 'at_least': {t: p}, 'quantiles': {q: v}} for one column.
+
+    `col` is a SortedColumn or anything with the same query methods (see cube.CubeColumn).
+    """
+    return {
+        'count': col.total,
+        'at_most': dict(zip(at_most, col.prob_at_most(at_most))),
+        'at_least': dict(zip(at_least, col.prob_at_least(at_least))),
+        'quantiles': dict(zip(quantiles, col.quantiles(quantiles))),
+    }
+
+
+def tile_columns(df, dr_range):
+    """SortedColumn of each retracement/extension column, keyed by (kind, measure)."""
+    return {(kind, measure): SortedColumn(float_values(df[f'{dr_range}_{kind}_Max_{measure}_STD']))
+            for kind in ('M7Box', 'DR') for measure in ('Retracement', 'Extension')}
+
+
+def summarize_tiles(columns, retracement_thresholds=RETRACEMENT_THRESHOLDS,
+                    extension_thresholds=EXTENSION_THRESHOLDS, quantiles=QUANTILES):
+    """Retracements are hit at or below a threshold, extensions at or above."""
+    results = {}
+    for (kind, measure), col in columns.items():
+        if measure == 'Retracement':
+            results[(kind, measure)] = summarize(col, at_most=retracement_thresholds, quantiles=quantiles)
+        else:
+            results[(kind, measure)] = summarize(col, at_least=extension_thresholds, quantiles=quantiles)
+    return results
+
+
+def tile_metrics(df, dr_range, retracement_thresholds=RETRACEMENT_THRESHOLDS,
+                 extension_thresholds=EXTENSION_THRESHOLDS, quantiles=QUANTILES):
+    """Metrics of the M7Box and DR retracement/extension columns of `dr_range`.
+
+    Keyed by (kind, measure), e.g. ('M7Box', 'Retracement').
+    """
+    return summarize_tiles(tile_columns(df, dr_range), retracement_thresholds, extension_thresholds, quantiles)
+
+
+def threshold_table(metrics):
+    """Long-format table of every probability in `tile_metrics` output."""
+    rows = []
+    for (kind, measure), m in metrics.items():
+        for side, probs in (('at most', m['at_most']), ('at least', m['at_least'])):
+            for threshold, p in probs.items():
+                rows.append({'Confirmation': kind, 'Measure': measure, 'Hit': side,
+                             'Threshold': threshold, 'Probability': p})
+    return pd.DataFrame(rows, columns=['Confirmation', 'Measure', 'Hit', 'Threshold', 'Probability'])
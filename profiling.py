@@ -0,0 +1,275 @@
+"""Per-stage timing of dashboard reruns.
+
+Every script rerun (and every rerun of a fragment on its own) gets a `RerunProfile`. Code
+along the pipeline wraps its stages in `stage(...)`, which records wall time, rows in and
+out and the change in resident memory. Stages nest, and a stage entered again within the
+same parent (once per CSV chunk, once per compared group) adds to the same record. Outside
+a profiled rerun `stage` records nothing, so library code is instrumented unconditionally.
+
+Finished reruns are kept in a short in-process history for the admin panel and appended to
+a JSON-lines log, one line per stage, so latencies can be aggregated across users and
+sessions. Once the log reaches M7BOX_PROFILE_LOG_MB it is moved to `<log>.1`, replacing the
+previous one, so the two files together stay under twice that size:
+
+    python profiling.py logs/profile.jsonl
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+import pandas as pd
+
+# Set M7BOX_PROFILE_LOG to an empty string to turn the log off
+PROFILE_LOG = os.environ.get('M7BOX_PROFILE_LOG',
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs', 'profile.jsonl'))
+PROFILE_LOG_BYTES = int(float(os.environ.get('M7BOX_PROFILE_LOG_MB', 50)) * 2**20)
+HISTORY_RERUNS = 500
+PERCENTILES = (0.5, 0.9, 0.99)
+
+_local = threading.local()
+_history = deque(maxlen=HISTORY_RERUNS)
+_log_lock = threading.Lock()
+
+
+def rss_bytes():
+    """Resident set size of this process, or None where /proc isn't available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return None
+
+
+class PeakRSS:
+    """Highest resident set size seen while the block runs, sampled every few milliseconds.
+
+    RSS rather than tracemalloc, because pandas' CSV parser and Arrow allocate outside of
+    Python's allocator.
+    """
+
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.start = self.peak = rss_bytes()
+        self._done = threading.Event()
+
+    def _sample(self):
+        while not self._done.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def __enter__(self):
+        if self.start is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            self._done.set()
+            self._thread.join()
+            self.peak = max(self.peak, rss_bytes())
+
+
+class StageCall:
+    """What one pass through a stage reports; set `rows_out` (or `rows_in`) inside the block."""
+
+    def __init__(self, rows_in=None):
+        self.rows_in = rows_in
+        self.rows_out = None
+
+
+def _add(total, value):
+    return total if value is None else (total or 0) + value
+
+
+class Stage:
+    def __init__(self, path):
+        self.path = path
+        self.calls = 0
+        self.seconds = 0.0
+        self.rows_in = None
+        self.rows_out = None
+        self.rss_delta = None
+
+    @property
+    def name(self):
+        return self.path[-1]
+
+    @property
+    def depth(self):
+        return len(self.path) - 1
+
+    def add(self, call, seconds, rss_delta):
+        self.calls += 1
+        self.seconds += seconds
+        self.rows_in = _add(self.rows_in, call.rows_in)
+        self.rows_out = _add(self.rows_out, call.rows_out)
+        self.rss_delta = _add(self.rss_delta, rss_delta)
+
+
+class RerunProfile:
+    def __init__(self, trigger, session=None, user=None):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.trigger = trigger      # 'full' or the name of the fragment that reran
+        self.session = session
+        self.user = user
+        self.started_at = time.time()
+        self.stages = {}            # path -> Stage, in the order they were first entered
+        self.seconds = None
+        self.rss_delta = None
+        self._stack = []
+        self._start = time.perf_counter()
+        self._rss_start = rss_bytes()
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        path = tuple(self._stack) + (name,)
+        record = self.stages.get(path)
+        if record is None:
+            record = self.stages[path] = Stage(path)
+        call = StageCall(rows_in)
+        self._stack.append(name)
+        rss_start, start = rss_bytes(), time.perf_counter()
+        try:
+            yield call
+        finally:
+            seconds = time.perf_counter() - start
+            rss_end = rss_bytes()
+            self._stack.pop()
+            record.add(call, seconds, rss_end - rss_start if rss_start is not None else None)
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self._start
+        rss_end = rss_bytes()
+        self.rss_delta = rss_end - self._rss_start if self._rss_start is not None else None
+
+    def records(self):
+        """One dict per stage, plus a 'total' line for the whole rerun."""
+        context = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started_at)),
+                   'run': self.run_id, 'trigger': self.trigger, 'session': self.session, 'user': self.user}
+        lines = [{**context, 'stage': 'total', 'depth': 0, 'calls': 1, 'seconds': self.seconds,
+                  'rows_in': None, 'rows_out': None, 'rss_delta_mb': _mb(self.rss_delta)}]
+        for stage in self.stages.values():
+            lines.append({**context, 'stage': '/'.join(stage.path), 'depth': stage.depth + 1, 'calls': stage.calls,
+                          'seconds': stage.seconds, 'rows_in': stage.rows_in, 'rows_out': stage.rows_out,
+                          'rss_delta_mb': _mb(stage.rss_delta)})
+        return lines
+
+
+def _mb(n_bytes):
+    return None if n_bytes is None else round(n_bytes / 2**20, 2)
+
+
+def current():
+    """The profile of the rerun running on this thread, if any."""
+    return getattr(_local, 'profile', None)
+
+
+@contextmanager
+def stage(name, rows_in=None):
+    profile = current()
+    if profile is None:
+        yield StageCall(rows_in)
+        return
+    with profile.stage(name, rows_in) as call:
+        yield call
+
+
+def begin_rerun(trigger, session=None, user=None):
+    _local.profile = RerunProfile(trigger, session, user)
+    return _local.profile
+
+
+def end_rerun(log_path=PROFILE_LOG):
+    profile = current()
+    if profile is None:
+        return None
+    _local.profile = None
+    profile.finish()
+    _history.append(profile)
+    if log_path:
+        write_log(profile, log_path)
+    return profile
+
+
+@contextmanager
+def rerun(trigger, session=None, user=None, log_path=PROFILE_LOG):
+    """Profile the block as a rerun of its own, unless one is already running (a fragment inside a full rerun)."""
+    if current() is not None:
+        yield current()
+        return
+    profile = begin_rerun(trigger, session, user)
+    try:
+        yield profile
+    finally:
+        end_rerun(log_path)
+
+
+def write_log(profile, path, max_bytes=PROFILE_LOG_BYTES):
+    lines = ''.join(json.dumps(record) + '\n' for record in profile.records())
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with _log_lock:
+            if os.path.exists(path) and os.path.getsize(path) >= max_bytes:
+                os.replace(path, path + '.1')
+            with open(path, 'a') as f:
+                f.write(lines)
+    except OSError:
+        pass  # a read-only or full disk shouldn't take the dashboard down
+
+
+def recent_reruns(session=None):
+    """Finished reruns still in this process's history, oldest first; only `session`'s if given."""
+    return [profile for profile in list(_history) if session is None or profile.session == session]
+
+
+def stage_table(profile):
+    """A rerun's stages for display, nested stages indented under their parent."""
+    return pd.DataFrame([{
+        'Stage': '\u2003' * stage.depth + stage.name,  # em spaces survive st.dataframe
+        'ms': stage.seconds * 1000,
+        'Calls': stage.calls,
+        'Rows in': stage.rows_in,
+        'Rows out': stage.rows_out,
+        'Memory Δ (MB)': _mb(stage.rss_delta),
+    } for stage in profile.stages.values()])
+
+
+def stage_percentiles(records, percentiles=PERCENTILES):
+    """Latency percentiles (ms) and rerun count of every stage, from `records()` lines or the log."""
+    records = pd.DataFrame(records)
+    if records.empty:
+        return pd.DataFrame()
+    latency = records.groupby('stage', sort=False)['seconds'].quantile(list(percentiles)).unstack() * 1000
+    latency.columns = [f'p{q * 100:g} ms' for q in percentiles]
+    latency.insert(0, 'Reruns', records.groupby('stage', sort=False)['run'].nunique())
+    return latency
+
+
+def read_log(path=PROFILE_LOG):
+    """Every record in the log, the rotated-out `<log>.1` first."""
+    parts = [pd.read_json(file, lines=True) for file in (path + '.1', path) if os.path.exists(file)]
+    return pd.concat(parts, ignore_index=True) if parts else pd.read_json(path, lines=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency percentiles per stage from the profiling log.")
+    parser.add_argument('log', nargs='?', default=PROFILE_LOG)
+    parser.add_argument('--trigger', help="only reruns of this kind ('full' or a fragment name)")
+    parser.add_argument('--since', help="only reruns from this date/time on, e.g. 2025-03-01")
+    args = parser.parse_args()
+    records = read_log(args.log)
+    if args.trigger:
+        records = records[records['trigger'] == args.trigger]
+    if args.since:
+        records = records[pd.to_datetime(records['timestamp']) >= pd.Timestamp(args.since)]
+    with pd.option_context('display.width', 200, 'display.max_rows', None, 'display.float_format', '{:.1f}'.format):
+        print(stage_percentiles(records))
+
+
+if __name__ == '__main__':
+    main()
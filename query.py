@@ -0,0 +1,342 @@
+"""Pluggable query backends for one filtered view.
+
+A view is the categorical selections, the right-exclusive box size and confirmation time
+windows, and the tile thresholds, quantiles and chart bins computed over the rows that match.
+A backend answers it from a saved dataset (by name) or a DataFrame and returns what
+analysis.filtered_results returns: (row count, tile stats, {spec: (counts, labels)}).
+
+`PandasBackend` is the reference: the filter index and numpy path the dashboard has always
+used, over the loaded rows. `DuckDBBackend` compiles the whole view into one SQL query over
+the stored Arrow segment files. Only the selected Instruments' partitions are scanned, DuckDB
+pushes the filters and the column list down into the scan, and only aggregates come back.
+DuckDB is optional; the dashboard uses it when M7BOX_QUERY_BACKEND=duckdb.
+
+Backends must agree exactly. `python query.py` checks them against each other over random
+views of a dataset or CSV:
+
+    python query.py nq_es_2024 --samples 200
+    python query.py exports/latest.csv --dr-range RDR --backends pandas duckdb
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from analysis import ALL, filtered_results, make_selections, summarize_results
+from binning import bin_bounds, bin_labels
+from charts import CHART_SPECS
+from compare import full_windows
+from filters import FilterIndex
+from ingest import concat_chunks, read_csv_path
+from metrics import EXTENSION_TABLE, RETRACEMENT_TABLE, TABLE_QUANTILES, summarize_tiles
+from profiling import stage
+from schema import DR_RANGES, box_size_column, categorical_columns, columns_for, std_columns, time_columns
+from store import (column_ranges, list_datasets, list_instruments, read_column_ranges, read_meta, read_partition,
+                   segment_paths)
+
+try:
+    import duckdb
+except ImportError:  # only the DuckDB backend needs it
+    duckdb = None
+
+DEFAULT_BACKEND = os.environ.get('M7BOX_QUERY_BACKEND', 'pandas')
+TILE_COLUMNS = [(kind, measure) for kind in ('M7Box', 'DR') for measure in ('Retracement', 'Extension')]
+
+
+def _partitions(source, selections):
+    """Instrument partitions of a saved dataset that `selections` can match.
+
+    At least one is always read, so a selection matching no Instrument still has columns to filter.
+    """
+    instruments = list_instruments(source)
+    if 'Instrument' not in selections:
+        return instruments
+    wanted = {str(value) for value in selections['Instrument']}
+    return [inst for inst in instruments if inst in wanted] or instruments[:1]
+
+
+class PandasBackend:
+    """The reference: load the rows, filter through a FilterIndex, aggregate with numpy."""
+    name = 'pandas'
+
+    def results(self, source, dr_range, selections, windows=None, value_ranges=None):
+        if isinstance(source, str):
+            value_ranges = value_ranges or read_column_ranges(source)
+            df = concat_chunks([read_partition(source, inst, columns=columns_for(dr_range))
+                                for inst in _partitions(source, selections)])
+        else:
+            df = source
+            value_ranges = value_ranges or column_ranges(df)
+        windows = full_windows(value_ranges, dr_range) if windows is None else windows
+        return filtered_results(df, FilterIndex(df), dr_range, selections, windows, value_ranges)
+
+
+class QueryColumn:
+    """One STD column's aggregates as a query returned them.
+
+    Has the same query methods as metrics.SortedColumn, for the thresholds and quantiles the
+    query computed.
+    """
+
+    def __init__(self, total, at_most, at_least, quantiles):
+        self.total = total
+        self.at_most = at_most      # {threshold: rows at or below}
+        self.at_least = at_least    # {threshold: rows at or above}
+        self.quantile_values = quantiles
+
+    def prob_at_most(self, thresholds):
+        if self.total == 0:
+            return np.zeros(len(thresholds))
+        return np.array([self.at_most[t] for t in thresholds]) / self.total
+
+    def prob_at_least(self, thresholds):
+        if self.total == 0:
+            return np.zeros(len(thresholds))
+        return np.array([self.at_least[t] for t in thresholds]) / self.total
+
+    def quantiles(self, qs):
+        return np.array([self.quantile_values[q] for q in qs], dtype='float64')
+
+
+def _quote(col):
+    return '"' + col.replace('"', '""') + '"'
+
+
+def _literal(value):
+    # Plain numeric literals are DECIMAL in DuckDB; the reference computes in float64
+    return f'{float(value)!r}::DOUBLE'
+
+
+def _bin_code(col, bin_width, lo):
+    """SQL of binning.bin_codes before its range check: right-closed bins, lowest edge in the first."""
+    v = f'CAST({_quote(col)} AS DOUBLE)'
+    return (f'CASE WHEN {v} = {_literal(bin_width * lo)} THEN 0 '
+            f'ELSE CAST(ceil({v} / {_literal(bin_width)}) AS BIGINT) - 1 - {lo} END')
+
+
+def _order_statistics(sorted_list, qs):
+    """SQL of the two order statistics around each quantile's position in a sorted list.
+
+    They are interpolated by `_interpolate` in numpy, in the same float64 arithmetic as
+    metrics.SortedColumn.quantiles (DuckDB's own quantile_cont can differ in the last bit).
+    """
+    pos = f'CAST(floor(q * (len({sorted_list}) - 1)) AS BIGINT)'
+    return (f'list_transform([{", ".join(map(_literal, qs))}], q -> '
+            f'[{sorted_list}[{pos} + 1], {sorted_list}[least({pos} + 2, len({sorted_list}))]])')
+
+
+def _interpolate(n, order_statistics, qs):
+    if not n:  # no values, or no rows at all (a NULL list)
+        return np.full(len(qs), np.nan)
+    lower, upper = np.array(order_statistics, dtype='float64').T
+    pos = np.asarray(qs, dtype='float64') * (n - 1)
+    return lower + (upper - lower) * (pos - np.floor(pos))
+
+
+_connection = None
+
+
+def _cursor():
+    """A cursor on the process-wide in-memory DuckDB; each query gets its own, so sessions don't share state."""
+    global _connection
+    if _connection is None:
+        _connection = duckdb.connect()
+    return _connection.cursor()
+
+
+class DuckDBBackend:
+    """The view as one DuckDB query over the stored Arrow files (or an in-memory table)."""
+    name = 'duckdb'
+
+    def __init__(self):
+        if duckdb is None:
+            raise ValueError("The DuckDB backend needs the duckdb package (pip install duckdb).")
+
+    @staticmethod
+    def _scans(source, dr_range, selections):
+        """Arrow dataset (or table) of every segment file the view has to read."""
+        if not isinstance(source, str):
+            # NaN becomes null on the way into Arrow, as it did when the stored files were written
+            return [pa.Table.from_pandas(source[[col for col in columns_for(dr_range) if col in source]],
+                                         preserve_index=False)]
+        meta = read_meta(source)
+        return [ds.dataset(path, format='ipc')
+                for inst in _partitions(source, selections) for path in segment_paths(source, inst, meta)]
+
+    @staticmethod
+    def _segment_query(relation, schema, columns, selections, windows):
+        """SQL and parameters of one segment's rows in the view, projected to `columns`."""
+        conditions, params = [], []
+        for col, values in selections.items():
+            conditions.append(f'{_quote(col)} IN ({", ".join("?" * len(values))})' if values else 'false')
+            params += [str(value) for value in values]
+        for col, (lo, hi) in windows.items():
+            if pa.types.is_time(schema.field(col).type):
+                # Datasets saved before times were stored as seconds hold time columns
+                lo, hi = (datetime.time(int(v) // 3600, int(v) // 60 % 60, int(v) % 60) for v in (lo, hi))
+            # Right exclusive, like the sliders
+            conditions.append(f'{_quote(col)} >= ? AND {_quote(col)} < ?')
+            params += [lo, hi]
+        where = ' AND '.join(conditions) or 'true'
+        return f'SELECT {", ".join(map(_quote, columns))} FROM {relation} WHERE {where}', params
+
+    def results(self, source, dr_range, selections, windows=None, value_ranges=None):
+        if value_ranges is None:
+            value_ranges = read_column_ranges(source) if isinstance(source, str) else column_ranges(source)
+        windows = full_windows(value_ranges, dr_range) if windows is None else windows
+
+        # Inner aggregates run over the scan; the outer select only picks order statistics from sorted lists
+        inner, outer = ['count(*) AS n'], ['n']
+        for i, (kind, measure) in enumerate(TILE_COLUMNS):
+            col = _quote(f'{dr_range}_{kind}_Max_{measure}_STD')
+            # Compared in float32, like the float32 columns in metrics.SortedColumn
+            if measure == 'Retracement':
+                thresholds = [f'{col} <= CAST({_literal(t)} AS FLOAT)' for t in RETRACEMENT_TABLE]
+            else:
+                thresholds = [f'{col} >= CAST({_literal(t)} AS FLOAT)' for t in EXTENSION_TABLE]
+            inner += [f'count_if({hit}) AS hit_{i}_{j}' for j, hit in enumerate(thresholds)]
+            outer += [f'hit_{i}_{j}' for j in range(len(thresholds))]
+            inner.append(f'list_sort(list(CAST({col} AS DOUBLE)) FILTER (WHERE {col} IS NOT NULL)) AS sorted_{i}')
+            outer += [f'len(sorted_{i})', _order_statistics(f'sorted_{i}', TABLE_QUANTILES)]
+        # Bin codes are computed once per row, below the aggregates that count them
+        binned, chart_bounds = ['*'], {}
+        for i, spec in enumerate(CHART_SPECS):
+            col, value_range = spec.column_for(dr_range), value_ranges.get(spec.column_for(dr_range))
+            if value_range is None or value_range[0] is None:
+                continue
+            lo, hi = chart_bounds[spec] = bin_bounds(value_range[0], value_range[1], spec.bin_width)
+            binned.append(f'{_bin_code(col, spec.bin_width, lo)} AS bin_{i}')
+            inner += [f'count({_quote(col)}) AS present_{i}',
+                      f'histogram(bin_{i}) FILTER (WHERE bin_{i} BETWEEN 0 AND {hi - lo - 1}) AS bins_{i}']
+            outer += [f'present_{i}', f'bins_{i}']
+
+        columns = std_columns(dr_range)  # the tiles' and the charts'
+        con = _cursor()
+        try:
+            branches, params = [], []
+            for i, scan in enumerate(self._scans(source, dr_range, selections)):
+                con.register(f'segment_{i}', scan)
+                branch, branch_params = self._segment_query(f'segment_{i}', scan.schema, columns, selections, windows)
+                branches.append(branch)
+                params += branch_params
+            with stage('query') as queried:
+                row = con.execute(f'SELECT {", ".join(outer)} FROM (SELECT {", ".join(inner)} FROM '
+                                  f'(SELECT {", ".join(binned)} FROM ({" UNION ALL ".join(branches)})))',
+                                  params).fetchone()
+                queried.rows_out = row[0]
+        finally:
+            con.close()
+
+        values = iter(row)
+        total_count = next(values)
+        tile_inputs = {}
+        for kind, measure in TILE_COLUMNS:
+            thresholds = RETRACEMENT_TABLE if measure == 'Retracement' else EXTENSION_TABLE
+            hits = {t: next(values) for t in thresholds}
+            quantiles = dict(zip(TABLE_QUANTILES, _interpolate(next(values), next(values), TABLE_QUANTILES)))
+            tile_inputs[(kind, measure)] = QueryColumn(total_count, hits if measure == 'Retracement' else {},
+                                                       {} if measure == 'Retracement' else hits, quantiles)
+        chart_counts = {}
+        for spec in CHART_SPECS:
+            present, buckets = (next(values), next(values)) if spec in chart_bounds else (0, None)
+            if not present:
+                chart_counts[spec] = np.zeros(0, dtype=np.int64), ()
+                continue
+            lo, hi = chart_bounds[spec]
+            counts = np.zeros(hi - lo, dtype=np.int64)
+            counts[list(buckets or {})] = list((buckets or {}).values())
+            chart_counts[spec] = counts, bin_labels(spec.bin_width, lo, hi)
+        tile_stats = summarize_tiles(tile_inputs, RETRACEMENT_TABLE, EXTENSION_TABLE, TABLE_QUANTILES)
+        return total_count, tile_stats, chart_counts
+
+
+BACKENDS = {'pandas': PandasBackend, 'duckdb': DuckDBBackend}
+
+
+def get_backend(name=DEFAULT_BACKEND):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown query backend {name!r}; expected one of {', '.join(BACKENDS)}.")
+    return BACKENDS[name]()
+
+
+def backend_differences(results, dr_range):
+    """Where backends' results of one view disagree: [(backend, key, value, reference value)].
+
+    The first backend is the reference; everything is compared exactly in its JSON form.
+    """
+    summaries = {name: summarize_results(dr_range, *result) for name, result in results.items()}
+    reference_name, reference = next(iter(summaries.items()))
+    differences = []
+    for name, summary in summaries.items():
+        for key in ('sessions', 'tiles', 'charts'):
+            if json.dumps(summary[key], sort_keys=True) != json.dumps(reference[key], sort_keys=True):
+                differences.append((name, key, summary[key], reference[key]))
+    return differences
+
+
+def random_view(rng, options, value_ranges, dr_range):
+    """Random selections and slider windows of `dr_range`, shaped like the dashboard's."""
+    choices = {col: ALL if rng.random() < 0.5 else rng.sample(values, rng.randint(1, len(values)))
+               for col, values in options.items() if values}
+    windows = full_windows(value_ranges, dr_range)
+    for col in [box_size_column(dr_range)] + time_columns(dr_range):
+        lo, hi = windows[col]
+        if lo is not None and rng.random() < 0.5:
+            a, b = sorted(rng.uniform(lo, hi) for _ in range(2))
+            windows[col] = (int(a), int(b)) if isinstance(lo, int) else (a, b)
+    return make_selections(choices), windows
+
+
+def check_backends(source, backends, samples=100, dr_ranges=DR_RANGES, seed=0):
+    """Run `samples` random views per DR range on every backend; returns (mismatches, seconds per backend)."""
+    backends = [get_backend(name) for name in backends]
+    if isinstance(source, str) and source in list_datasets():
+        value_ranges = read_column_ranges(source)
+        df = concat_chunks([read_partition(source, inst) for inst in list_instruments(source)])
+    else:
+        source = df = read_csv_path(source)
+        value_ranges = column_ranges(df)
+    rng = random.Random(seed)
+    mismatches, seconds = [], {backend.name: 0.0 for backend in backends}
+    for dr_range in dr_ranges:
+        options = {col: df[col].dropna().unique().tolist() for col in ['Instrument', 'Day of Week']
+                   + categorical_columns(dr_range)}
+        for _ in range(samples):
+            selections, windows = random_view(rng, options, value_ranges, dr_range)
+            results = {}
+            for backend in backends:
+                start = time.perf_counter()
+                results[backend.name] = backend.results(source, dr_range, selections, windows, value_ranges)
+                seconds[backend.name] += time.perf_counter() - start
+            for difference in backend_differences(results, dr_range):
+                mismatches.append((dr_range, selections, windows) + difference)
+    return mismatches, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the query backends return the same results.")
+    parser.add_argument('source', help="dataset name in the library, or a CSV file or directory of CSVs")
+    parser.add_argument('--backends', nargs='+', choices=list(BACKENDS), default=['pandas', 'duckdb'],
+                        help="the first one is the reference")
+    parser.add_argument('--dr-range', nargs='+', choices=DR_RANGES, default=DR_RANGES)
+    parser.add_argument('--samples', type=int, default=100, help="random views per DR range")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    mismatches, seconds = check_backends(args.source, args.backends, args.samples, args.dr_range, args.seed)
+    for dr_range, selections, windows, backend, key, value, expected in mismatches[:10]:
+        print(f"{backend} differs on {key} for {dr_range} {selections} {windows}:\n  {value}\n  expected {expected}")
+    for name, total in seconds.items():
+        print(f"{name:<8} {total / (args.samples * len(args.dr_range)) * 1000:8.1f} ms per view")
+    print(f"{len(mismatches)} mismatches in {args.samples * len(args.dr_range)} views")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""Nightly report: the dashboard's statistics for every combination of filters.
+
+For every Instrument × DR range × day × M7Box direction × model, writes the session count,
+tile probabilities, threshold table, quantiles and chart buckets the dashboard would show
+with the sliders at their full range. Each Instrument × DR range is one task in a process
+pool: the worker loads that partition, builds its aggregate cube once, and answers every
+combination from the cube.
+
+    python report.py nq_es_2024 reports/2025-03-01              # a dataset in the library
+    python report.py exports/latest.csv reports/latest --format json html --workers 8
+"""
+import argparse
+import html
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from analysis import ALL, cube_results, make_selections, summarize_results, window_cube
+from charts import CHART_SPECS, chart_from_counts
+from compare import full_windows
+from cube import SegmentedCube
+from filters import FilterIndex
+from ingest import read_csv_path
+from schema import DAYS, DR_RANGES, columns_for
+from store import column_ranges, list_datasets, list_instruments, read_column_ranges, read_partition
+
+REPORT_FORMATS = ['json', 'html']
+
+
+def _values(df, col):
+    return sorted(df[col].dropna().unique().tolist(), key=str)
+
+
+def partition_report(source, instrument, dr_range, value_ranges, df=None, min_sessions=1):
+    """Every day × direction × model combination of one Instrument and DR range.
+
+    `df` holds the Instrument's rows when the source is a CSV; saved datasets are read here,
+    in the worker, so only the partition's name crosses the process boundary.
+    """
+    if df is None:
+        df = read_partition(source, instrument, columns=columns_for(dr_range))
+    r = dr_range
+    filter_index = FilterIndex(df)
+    cube = SegmentedCube([window_cube(df, filter_index, r, full_windows(value_ranges, r))], value_ranges)
+
+    combinations = []
+    for day in [ALL] + [d for d in DAYS if d in _values(df, 'Day of Week')]:
+        for direction in [ALL] + _values(df, f'{r}_M7Box_Direction'):
+            for model in [ALL] + _values(df, f'{r} Model'):
+                selections = make_selections({'Instrument': instrument, 'Day of Week': day,
+                                              f'{r}_M7Box_Direction': direction, f'{r} Model': model})
+                results = cube_results(cube, r, selections)
+                if results[0] < min_sessions:
+                    continue
+                combinations.append({'instrument': instrument, 'dr_range': r, 'day': day, 'direction': direction,
+                                     'model': model, **summarize_results(r, *results)})
+    return combinations
+
+
+def _partition_task(args):
+    return partition_report(*args)
+
+
+def _tasks(source, min_sessions):
+    """Arguments of `partition_report` for every Instrument × DR range of a dataset name or CSV path."""
+    if source in list_datasets():
+        value_ranges = read_column_ranges(source)
+        return [(source, inst, r, value_ranges, None, min_sessions)
+                for inst in list_instruments(source) for r in DR_RANGES]
+    df = read_csv_path(source)
+    value_ranges = column_ranges(df)
+    tasks = []
+    for inst in _values(df, 'Instrument'):
+        rows = df[df['Instrument'] == inst]
+        for r in DR_RANGES:
+            tasks.append((source, inst, r, value_ranges, rows[columns_for(r)].reset_index(drop=True), min_sessions))
+    return tasks
+
+
+def build_report(source, workers=None, min_sessions=1):
+    """The report of `source` (a saved dataset name or a CSV file/directory) as a dict."""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        combinations = [combination for partition in pool.map(_partition_task, _tasks(source, min_sessions))
+                        for combination in partition]
+    return {'source': source, 'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'combinations': combinations}
+
+
+def summary_table(report):
+    """One row per combination with the dashboard's tile labels."""
+    rows = []
+    for c in report['combinations']:
+        row = {'Instrument': c['instrument'], 'DR Range': c['dr_range'], 'Day': c['day'],
+               'Direction': c['direction'], 'Model': c['model'], 'Sessions': c['sessions']}
+        for kind in ('M7Box', 'DR'):
+            ret, ext = c['tiles'][f'{kind} Retracement'], c['tiles'][f'{kind} Extension']
+            row[f'% Hitting -1 After {kind} Conf.'] = ret['at_most']['-1']
+            row[f'% Hitting 0 After {kind} Conf.'] = ret['at_most']['0']
+            row[f'% Hitting 0.5 After {kind} Conf.'] = ext['at_least']['0.5']
+            row[f'% Hitting 1 After {kind} Conf.'] = ext['at_least']['1']
+            row[f'Median Ret. After {kind} Conf.'] = ret['quantiles']['0.5']
+            row[f'Median Ext. After {kind} Conf.'] = ext['quantiles']['0.5']
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def report_html(report):
+    """Self-contained page: the summary table, plus the unfiltered charts of every Instrument × DR range."""
+    table = summary_table(report)
+    percent_columns = [col for col in table.columns if col.startswith('%')]
+    median_columns = [col for col in table.columns if col.startswith('Median')]
+    styled = (table.style.format("{:.2%}", subset=percent_columns, na_rep='')
+              .format("{:.2f}", subset=median_columns, na_rep='').hide(axis='index'))
+
+    sections = []
+    include_plotlyjs = 'cdn'
+    for c in report['combinations']:
+        if (c['day'], c['direction'], c['model']) != (ALL, ALL, ALL):
+            continue
+        figures = []
+        for spec in CHART_SPECS:
+            chart = c['charts'].get(spec.column_for(c['dr_range']))
+            fig = chart and chart_from_counts(spec, c['dr_range'], np.array(chart['counts']),
+                                              chart['labels'])
+            if fig is not None:
+                figures.append(fig.to_html(full_html=False, include_plotlyjs=include_plotlyjs))
+                include_plotlyjs = False  # load plotly.js once per page
+        sections.append(f"<h2>{html.escape(str(c['instrument']))} {c['dr_range']}</h2>\n" + '\n'.join(figures))
+
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>M7Box Report</title>
+<style>body {{ font-family: sans-serif; }} table {{ border-collapse: collapse; font-size: 12px; }}
+td, th {{ border: 1px solid #ddd; padding: 2px 6px; text-align: right; }}</style></head>
+<body><h1>M7Box Report</h1>
+<p>{html.escape(report['source'])} · generated {report['generated_at']} · {len(report['combinations']):,} combinations</p>
+{styled.to_html()}
+{''.join(sections)}
+</body></html>
+"""
+
+
+def write_report(report, out_dir, formats=REPORT_FORMATS):
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    if 'json' in formats:
+        paths.append(os.path.join(out_dir, 'report.json'))
+        with open(paths[-1], 'w') as f:
+            json.dump(report, f)
+    if 'html' in formats:
+        paths.append(os.path.join(out_dir, 'report.html'))
+        with open(paths[-1], 'w') as f:
+            f.write(report_html(report))
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dashboard statistics for every combination of filters.")
+    parser.add_argument('source', help="dataset name in the library, or a CSV file or directory of CSVs")
+    parser.add_argument('out_dir')
+    parser.add_argument('--format', nargs='+', choices=REPORT_FORMATS, default=REPORT_FORMATS)
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument('--min-sessions', type=int, default=1, help="leave out combinations with fewer sessions")
+    args = parser.parse_args()
+    start = time.perf_counter()
+    report = build_report(args.source, args.workers, args.min_sessions)
+    for path in write_report(report, args.out_dir, args.format):
+        print(f"Wrote {path}")
+    print(f"{len(report['combinations']):,} combinations in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
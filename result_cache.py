@@ -0,0 +1,69 @@
+"""LRU cache of computed dashboard results, bounded by an approximate memory budget.
+
+One instance is shared by every session in the server process. Entries are sized by their
+pickled length, and the least recently used ones are evicted once the total goes over budget.
+"""
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+DEFAULT_BUDGET_MB = float(os.environ.get('M7BOX_RESULT_CACHE_MB', 256))
+
+
+def normalize_selections(selections):
+    """Hashable, order-independent form of a {column: [values]} selection."""
+    return tuple(sorted((col, tuple(sorted(values, key=str))) for col, values in selections.items()))
+
+
+class ResultCache:
+    def __init__(self, max_bytes=int(DEFAULT_BUDGET_MB * 1024 * 1024)):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            return  # would evict everything else and still not fit
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
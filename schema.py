@@ -0,0 +1,72 @@
+"""Column names and dtypes of the M7Box export that the dashboard reads."""
+
+DR_RANGES = ['ODR', 'RDR']
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
+
+MID_BROKEN_COLUMNS = ['ADR Mid Broken ', 'ODR Mid Broken ']  # trailing spaces are in the export
+
+
+def time_columns(dr_range):
+    return [f'{dr_range}_M7Box_Confirmation_Time_NY', f'{dr_range}_DR_Confirmation_Time_NY']
+
+
+def std_columns(dr_range):
+    return [
+        f'{dr_range}_M7Box_Max_Retracement_STD',
+        f'{dr_range}_DR_Max_Retracement_STD',
+        f'{dr_range}_M7Box_Max_Extension_STD',
+        f'{dr_range}_DR_Max_Extension_STD',
+    ]
+
+
+def categorical_columns(dr_range):
+    return [
+        f'{dr_range}_M7Box_Direction',
+        f'{dr_range}_M7Box_Confirmation_Direction',
+        f'{dr_range}_DR_Confirmation_Direction',
+        f'{dr_range}_Confirmation_Valid',
+        f'{dr_range}_M7Box_Confirmation_Valid',
+        f'{dr_range} Model',
+    ]
+
+
+def filter_dimensions(dr_range):
+    """Categorical columns the dashboard filters on when showing `dr_range`."""
+    return ['Instrument', 'Day of Week'] + categorical_columns(dr_range) + MID_BROKEN_COLUMNS
+
+
+def box_size_column(dr_range):
+    return f'{dr_range} M7Box / IDR'
+
+
+TIME_COLUMNS = [col for r in DR_RANGES for col in time_columns(r)]
+STD_COLUMNS = [col for r in DR_RANGES for col in std_columns(r)]
+BOX_SIZE_COLUMNS = [box_size_column(r) for r in DR_RANGES]
+CATEGORICAL_COLUMNS = (['Instrument', 'Day of Week']
+                       + [col for r in DR_RANGES for col in categorical_columns(r)]
+                       + MID_BROKEN_COLUMNS)
+
+# Explicit dtypes so read_csv doesn't have to infer them. Times stay strings here and are
+# parsed after the read into seconds since midnight (see clock.py).
+DTYPES = {
+    **{col: 'category' for col in CATEGORICAL_COLUMNS},
+    **{col: 'float32' for col in STD_COLUMNS},
+    **{col: 'float64' for col in BOX_SIZE_COLUMNS},
+    **{col: 'string' for col in TIME_COLUMNS},
+}
+
+
+def columns_for(dr_range):
+    """Every column the dashboard reads when showing `dr_range`."""
+    return (['Instrument', 'Day of Week'] + MID_BROKEN_COLUMNS + categorical_columns(dr_range)
+            + [box_size_column(dr_range)] + time_columns(dr_range) + std_columns(dr_range))
+
+
+USED_COLUMNS = {col for r in DR_RANGES for col in columns_for(r)}
+
+
+def check_columns(columns, source):
+    """Raise ValueError naming the columns the dashboard needs that `columns` doesn't have."""
+    missing = sorted(USED_COLUMNS - set(columns))
+    if missing:
+        raise ValueError(f"{source} is missing columns the dashboard needs: {', '.join(missing)}")
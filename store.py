@@ -0,0 +1,283 @@
+"""On-disk dataset library.
+
+Each saved dataset is a directory holding one uncompressed Arrow IPC (Feather v2) file per
+Instrument plus a small meta.json. Files are opened memory-mapped and only the requested
+columns are read, so switching to a saved dataset doesn't re-parse any CSV.
+
+New sessions are appended as extra segment files per Instrument rather than rewriting the
+partition, so a daily append only writes the new rows. `compact_dataset` folds the segments
+back into one file per Instrument.
+"""
+import datetime
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+
+from clock import clock_seconds
+from schema import BOX_SIZE_COLUMNS, STD_COLUMNS, TIME_COLUMNS, check_columns
+
+DATA_DIR = os.environ.get('M7BOX_DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+META_FILE = 'meta.json'
+
+
+def _dataset_dir(name):
+    return os.path.join(DATA_DIR, name)
+
+
+def _partition_file(instrument, segment=0):
+    # Instrument symbols are short tickers, but keep the filename safe regardless
+    base = re.sub(r'[^A-Za-z0-9_.-]', '_', str(instrument))
+    return f'{base}.arrow' if segment == 0 else f'{base}.{segment}.arrow'
+
+
+def clean_name(name):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', name.strip()).strip('._')
+
+
+def list_datasets():
+    if not os.path.isdir(DATA_DIR):
+        return []
+    return sorted(d for d in os.listdir(DATA_DIR) if os.path.isfile(os.path.join(DATA_DIR, d, META_FILE)))
+
+
+def read_meta(name):
+    with open(os.path.join(_dataset_dir(name), META_FILE)) as f:
+        return json.load(f)
+
+
+def list_instruments(name):
+    return list(read_meta(name)['partitions'])
+
+
+def partition_segments(meta, instrument):
+    """[{'file', 'rows'}] of one Instrument partition, in append order."""
+    partition = meta['partitions'][str(instrument)]
+    # Datasets saved before appends existed have a single file per partition
+    return partition.get('segments', [{'file': partition.get('file'), 'rows': partition['rows']}])
+
+
+def column_ranges(df):
+    """(min, max) of every slider and binned column, ignoring missing values."""
+    ranges = {}
+    for col in TIME_COLUMNS + BOX_SIZE_COLUMNS + STD_COLUMNS:
+        if col in df:
+            values = df[col].dropna()
+            if values.empty:
+                ranges[col] = (None, None)
+            elif col in TIME_COLUMNS:
+                ranges[col] = (int(values.min()), int(values.max()))
+            else:
+                ranges[col] = (values.min(), values.max())
+    return ranges
+
+
+def _ranges_to_json(ranges):
+    return {col: [None if v is None else int(v) if col in TIME_COLUMNS else float(v) for v in bounds]
+            for col, bounds in ranges.items()}
+
+
+def _ranges_from_json(ranges):
+    parsed = {}
+    for col, (lo, hi) in ranges.items():
+        if col in TIME_COLUMNS and lo is not None:
+            # Datasets saved before times were stored as seconds hold 'HH:MM:SS' strings
+            lo, hi = (clock_seconds(datetime.time.fromisoformat(v)) if isinstance(v, str) else int(v) for v in (lo, hi))
+        parsed[col] = (lo, hi)
+    return parsed
+
+
+def merge_column_ranges(a, b):
+    """Union of two `column_ranges` results."""
+    merged = dict(a)
+    for col, (lo, hi) in b.items():
+        if col in merged and merged[col][0] is not None:
+            if lo is None:
+                continue
+            lo, hi = min(lo, merged[col][0]), max(hi, merged[col][1])
+        merged[col] = (lo, hi)
+    return merged
+
+
+def read_column_ranges(name):
+    # Partitions only hold one instrument, so slider bounds come from the whole dataset
+    return _ranges_from_json(read_meta(name)['column_ranges'])
+
+
+def _write_meta(directory, meta):
+    # Written to a temporary file and renamed, so readers see the old or the new meta, never half of one
+    fd, tmp_path = tempfile.mkstemp(prefix='.meta-', dir=directory)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, os.path.join(directory, META_FILE))
+
+
+def save_dataset(df, name, source_hash=None):
+    """Write `df` partitioned by Instrument and return the cleaned dataset name.
+
+    The dataset is written to a temporary directory first and swapped in at the end, so
+    readers never see a half-written dataset.
+    """
+    name = clean_name(name)
+    if not name:
+        raise ValueError("Dataset name must contain letters or digits.")
+    check_columns(df.columns, "The dataset")
+    os.makedirs(DATA_DIR, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=f'.{name}-', dir=DATA_DIR)
+
+    partitions = {}
+    for instrument, part in df.groupby('Instrument', observed=True, sort=True):
+        table = pa.Table.from_pandas(part, preserve_index=False)
+        file_name = _partition_file(instrument)
+        # Uncompressed so the file can be memory-mapped without decoding
+        feather.write_feather(table, os.path.join(tmp_dir, file_name), compression='uncompressed')
+        partitions[str(instrument)] = {'segments': [{'file': file_name, 'rows': len(part)}], 'rows': len(part)}
+
+    meta = {
+        'name': name,
+        'source_hash': source_hash,
+        'rows': int(sum(p['rows'] for p in partitions.values())),
+        'columns': list(df.columns),
+        'partitions': partitions,
+        'column_ranges': _ranges_to_json(column_ranges(df)),
+        'saved_at': time.time(),
+    }
+    _write_meta(tmp_dir, meta)
+
+    target = _dataset_dir(name)
+    if os.path.exists(target):
+        old = tempfile.mkdtemp(prefix=f'.{name}-old-', dir=DATA_DIR)
+        os.replace(target, os.path.join(old, name))
+        os.replace(tmp_dir, target)
+        shutil.rmtree(old, ignore_errors=True)
+    else:
+        os.replace(tmp_dir, target)
+    return name
+
+
+def _stored_schema(name, meta):
+    segment = partition_segments(meta, next(iter(meta['partitions'])))[0]
+    with pa.memory_map(os.path.join(_dataset_dir(name), segment['file'])) as source:
+        schema = pa.ipc.open_file(source).schema
+    # New segments store times as seconds even when older segments hold time64 values
+    for i, field in enumerate(schema):
+        if pa.types.is_time(field.type):
+            schema = schema.set(i, field.with_type(pa.int32()))
+    return schema
+
+
+_TIME_UNITS = {'s': 1, 'ms': 1_000, 'us': 1_000_000, 'ns': 1_000_000_000}
+
+
+def _times_as_seconds(table):
+    """Datasets saved before times were stored as seconds hold Arrow time columns; read them as int32 seconds."""
+    for i, field in enumerate(table.schema):
+        if pa.types.is_time(field.type):
+            ticks = table.column(i).cast(pa.int64() if pa.types.is_time64(field.type) else pa.int32())
+            seconds = pc.divide(ticks, _TIME_UNITS[field.type.unit]).cast(pa.int32())
+            table = table.set_column(i, field.with_type(pa.int32()), seconds)
+    return table
+
+
+def _to_pandas(table):
+    # int32 columns are the confirmation times; keep them integer with missing values rather than float
+    return table.to_pandas(types_mapper={pa.int32(): pd.Int32Dtype()}.get)
+
+
+def append_dataset(df, name, source_hash=None):
+    """Append the rows of `df` to a saved dataset and return how many were added.
+
+    The rows must have exactly the stored columns and are cast to the stored column types;
+    anything that doesn't fit raises a ValueError before a file is written, as does a
+    `source_hash` that is already in the dataset. Each Instrument's new rows become one more
+    segment of its partition (or a new partition), so the cost depends on the new rows only.
+    """
+    meta = read_meta(name)
+    if source_hash is not None and source_hash in [meta.get('source_hash')] + meta.get('appended_sources', []):
+        raise ValueError(f"These rows are already in {name}.")
+    missing = [col for col in meta['columns'] if col not in df]
+    extra = [col for col in df.columns if col not in meta['columns']]
+    if missing or extra:
+        raise ValueError(f"New rows don't have the columns of {name}: "
+                         f"missing {missing or 'none'}, unexpected {extra or 'none'}.")
+    if df.empty:
+        return 0
+
+    schema = _stored_schema(name, meta)
+    tables = {}
+    for instrument, part in df[meta['columns']].groupby('Instrument', observed=True, sort=True):
+        try:
+            tables[str(instrument)] = pa.Table.from_pandas(part, preserve_index=False).cast(schema)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError) as e:
+            raise ValueError(f"New rows don't match the stored column types of {name}: {e}")
+
+    directory = _dataset_dir(name)
+    for instrument, table in tables.items():
+        partition = meta['partitions'].setdefault(instrument, {'segments': [], 'rows': 0})
+        partition['segments'] = partition_segments(meta, instrument) if partition['rows'] else []
+        partition.pop('file', None)
+        file_name = _partition_file(instrument, len(partition['segments']))
+        # Segment files are complete before meta.json names them, so readers never see a partial one
+        fd, tmp_path = tempfile.mkstemp(prefix='.segment-', dir=directory)
+        os.close(fd)
+        feather.write_feather(table, tmp_path, compression='uncompressed')
+        os.replace(tmp_path, os.path.join(directory, file_name))
+        partition['segments'].append({'file': file_name, 'rows': table.num_rows})
+        partition['rows'] += table.num_rows
+
+    meta['rows'] = int(sum(p['rows'] for p in meta['partitions'].values()))
+    meta['column_ranges'] = _ranges_to_json(merge_column_ranges(_ranges_from_json(meta['column_ranges']),
+                                                                column_ranges(df)))
+    meta['appended_sources'] = meta.get('appended_sources', []) + ([source_hash] if source_hash else [])
+    meta['appended_at'] = time.time()
+    _write_meta(directory, meta)
+    return sum(table.num_rows for table in tables.values())
+
+
+def compact_dataset(name):
+    """Rewrite a dataset with one file per Instrument, folding in every appended segment."""
+    meta = read_meta(name)
+    # Arrow unifies the per-segment category dictionaries when converting
+    df = _to_pandas(pa.concat_tables([read_partition_table(name, instrument) for instrument in meta['partitions']]))
+    name = save_dataset(df, name, source_hash=meta.get('source_hash'))
+    if meta.get('appended_sources'):
+        compacted = read_meta(name)
+        compacted['appended_sources'] = meta['appended_sources']
+        _write_meta(_dataset_dir(name), compacted)
+    return name
+
+
+def read_segment(name, file_name, columns=None):
+    """One segment file of a dataset as a DataFrame."""
+    meta = read_meta(name)
+    if columns is not None:
+        columns = [c for c in columns if c in meta['columns']]
+    return _to_pandas(_times_as_seconds(feather.read_table(os.path.join(_dataset_dir(name), file_name),
+                                                           columns=columns, memory_map=True)))
+
+
+def segment_paths(name, instrument, meta=None):
+    """Paths of every segment file of an Instrument partition, in append order."""
+    meta = meta or read_meta(name)
+    return [os.path.join(_dataset_dir(name), segment['file']) for segment in partition_segments(meta, instrument)]
+
+
+def read_partition_table(name, instrument, columns=None):
+    """Memory-map one Instrument partition (every segment of it) and return it as an Arrow table."""
+    meta = read_meta(name)
+    if columns is not None:
+        columns = [c for c in columns if c in meta['columns']]
+    tables = [_times_as_seconds(feather.read_table(path, columns=columns, memory_map=True))
+              for path in segment_paths(name, instrument, meta)]
+    return tables[0] if len(tables) == 1 else pa.concat_tables(tables)
+
+
+def read_partition(name, instrument, columns=None):
+    return _to_pandas(read_partition_table(name, instrument, columns))
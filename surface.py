@@ -0,0 +1,140 @@
+"""Hit probability over every box size × confirmation time window.
+
+Rows are counted into a 2-D grid of (box size bucket, confirmation time bucket), once for
+every row and once for the rows that hit the target. Both grids are turned into 2-D prefix
+sums, so the count inside any rectangle of buckets is four lookups and sweeping every window
+of a given size is a handful of array operations, however many rows there are.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import plotly.graph_objects as go
+
+from metrics import EXTENSION_THRESHOLDS, RETRACEMENT_THRESHOLDS, float_values
+from schema import box_size_column
+
+
+@dataclass(frozen=True)
+class HitTarget:
+    kind: str          # 'M7Box' or 'DR'
+    measure: str       # 'Retracement' (hit at or below) or 'Extension' (hit at or above)
+    threshold: float
+
+    @property
+    def label(self):
+        side = '≤' if self.measure == 'Retracement' else '≥'
+        return f"{self.kind} {self.measure} {side} {self.threshold:g}"
+
+    def column_for(self, dr_range):
+        return f'{dr_range}_{self.kind}_Max_{self.measure}_STD'
+
+    def hits(self, values):
+        """Which rows hit; missing values never do, as for the tiles."""
+        threshold = np.asarray(self.threshold, dtype=values.dtype)
+        return values <= threshold if self.measure == 'Retracement' else values >= threshold
+
+
+HIT_TARGETS = [HitTarget(kind, measure, t)
+               for kind in ('M7Box', 'DR')
+               for measure, thresholds in (('Retracement', RETRACEMENT_THRESHOLDS), ('Extension', EXTENSION_THRESHOLDS))
+               for t in thresholds]
+
+
+def minutes_since_midnight(series):
+    """Confirmation times (seconds since midnight) as float minutes, NaN where missing."""
+    return series.to_numpy(dtype='float64', na_value=np.nan) / 60
+
+
+def box_edges(value_range, n_buckets):
+    """`n_buckets` equal-width box size buckets spanning the dataset range."""
+    lo, hi = value_range
+    return np.linspace(lo, hi if hi > lo else lo + 1, n_buckets + 1)
+
+
+def time_edges(minute_range, step):
+    """Bucket edges every `step` minutes, on whole multiples of `step`, covering `minute_range`."""
+    lo = np.floor(minute_range[0] / step) * step
+    hi = max(np.ceil(minute_range[1] / step) * step, lo + step)
+    return np.arange(lo, hi + step / 2, step)
+
+
+def bucket_codes(values, edges):
+    """Bucket of each value, buckets closed on the left (the last one on both sides); -1 outside."""
+    codes = np.searchsorted(edges, values, side='right') - 1
+    codes[values == edges[-1]] = len(edges) - 2
+    codes[np.isnan(values) | (codes < 0) | (codes >= len(edges) - 1)] = -1
+    return codes
+
+
+class PrefixGrid:
+    """2-D prefix sums of per-bucket counts."""
+
+    def __init__(self, rows, cols, shape):
+        counts = np.bincount(rows * shape[1] + cols, minlength=shape[0] * shape[1]).reshape(shape)
+        self.prefix = np.zeros((shape[0] + 1, shape[1] + 1), dtype=np.int64)
+        self.prefix[1:, 1:] = counts.cumsum(axis=0).cumsum(axis=1)
+
+    def window_sum(self, row_lo, row_hi, col_lo, col_hi):
+        """Count in buckets [row_lo, row_hi) × [col_lo, col_hi); arguments broadcast like arrays."""
+        p = self.prefix
+        return p[row_hi, col_hi] - p[row_lo, col_hi] - p[row_hi, col_lo] + p[row_lo, col_lo]
+
+
+class ProbabilitySurface:
+    def __init__(self, box_values, minutes, hit, box_edges, time_edges):
+        self.box_edges, self.time_edges = box_edges, time_edges
+        box, time = bucket_codes(box_values, box_edges), bucket_codes(minutes, time_edges)
+        valid = (box >= 0) & (time >= 0)
+        shape = (len(box_edges) - 1, len(time_edges) - 1)
+        self.sessions = PrefixGrid(box[valid], time[valid], shape)
+        self.hits = PrefixGrid(box[valid & hit], time[valid & hit], shape)
+
+    @property
+    def shape(self):
+        return len(self.box_edges) - 1, len(self.time_edges) - 1
+
+    def window(self, box_lo, box_hi, time_lo, time_hi):
+        """(hits, sessions) with box bucket in [box_lo, box_hi) and time bucket in [time_lo, time_hi)."""
+        return (self.hits.window_sum(box_lo, box_hi, time_lo, time_hi),
+                self.sessions.window_sum(box_lo, box_hi, time_lo, time_hi))
+
+    def sweep(self, box_width, time_width):
+        """(hits, sessions) of every window `box_width` × `time_width` buckets wide, by starting bucket."""
+        n_box, n_time = self.shape
+        box_lo = np.arange(n_box - box_width + 1)[:, None]
+        time_lo = np.arange(n_time - time_width + 1)[None, :]
+        return self.window(box_lo, box_lo + box_width, time_lo, time_lo + time_width)
+
+
+def build_surface(df, dr_range, target, time_column, box_range, time_range, n_box_buckets, time_step):
+    """Surface of `target` over `dr_range`'s box size and `time_column`, on dataset-wide buckets."""
+    values = float_values(df[target.column_for(dr_range)])
+    minute_range = time_range[0] / 60, time_range[1] / 60
+    return ProbabilitySurface(float_values(df[box_size_column(dr_range)]).astype('float64'),
+                              minutes_since_midnight(df[time_column]), target.hits(values),
+                              box_edges(box_range, n_box_buckets), time_edges(minute_range, time_step))
+
+
+def _clock(minutes):
+    return f"{int(minutes) // 60:02d}:{int(minutes) % 60:02d}"
+
+
+def surface_figure(surface, box_width, time_width, min_sessions, title, shade_by='probability'):
+    """Heatmap of every window's hit probability (or session count), blank where there are too few sessions."""
+    hits, sessions = surface.sweep(box_width, time_width)
+    enough = sessions >= max(min_sessions, 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        probability = np.where(enough, hits / sessions * 100, np.nan)
+    box, time = surface.box_edges, surface.time_edges
+    y = [f"{box[i]:.2f} to {box[i + box_width]:.2f}" for i in range(len(box) - box_width)]
+    x = [f"{_clock(time[j])}-{_clock(time[j + time_width])}" for j in range(len(time) - time_width)]
+    z = probability if shade_by == 'probability' else np.where(enough, sessions, np.nan)
+    fig = go.Figure(go.Heatmap(
+        z=z, x=x, y=y, customdata=np.dstack([sessions, hits, probability]), colorscale='Teal',
+        colorbar=dict(title='% Hit' if shade_by == 'probability' else 'Sessions'),
+        hovertemplate="Box size %{y}<br>Confirmed %{x}<br>%{customdata[2]:.1f}% hit<br>"
+                      "%{customdata[1]} of %{customdata[0]} sessions<extra></extra>",
+    ))
+    fig.update_layout(height=600, margin=dict(l=5, r=5, t=30, b=30), title=title,
+                      xaxis_title="Confirmation Time (NY)", yaxis_title="Box Size", xaxis_tickangle=90)
+    return fig
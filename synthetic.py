@@ -0,0 +1,121 @@
+"""Synthetic M7Box exports for benchmarks and demos.
+
+Rows have the exact columns (and text formats) of the real export, including the trailing
+space in `ADR Mid Broken ` / `ODR Mid Broken ` and a couple of export columns the dashboard
+never reads. Values are drawn so that the filters and charts behave like real data: the
+confirmation direction mostly follows the box direction, unconfirmed sessions have no
+confirmation time or STD values, and retracements/extensions have long tails.
+
+    python synthetic.py 1000000 synthetic_1m.csv
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+from schema import DAYS, DR_RANGES
+
+INSTRUMENTS = ['NQ', 'ES', 'YM', 'RTY', 'CL', 'GC']
+MODELS = ['Continuation', 'Reversal', 'Expansion', 'Contraction', 'Inside']
+MID_BROKEN = ['Before Confirmation', 'After Confirmation', 'Not Broken']
+# (earliest, latest) M7Box confirmation, minutes since midnight NY
+SESSION_WINDOWS = {'ODR': (4 * 60, 8 * 60 + 25), 'RDR': (10 * 60 + 30, 15 * 60 + 55)}
+CHUNK_ROWS = 500_000
+
+
+# Every minute of the day as export text, so times are formatted with one lookup per row
+CLOCK = np.array([f'{m // 60:02d}:{m % 60:02d}:00' for m in range(24 * 60)], dtype=object)
+
+
+def _range_columns(rng, r, n):
+    columns = {}
+    direction = rng.choice(['Long', 'Short'], n)
+    confirmed = rng.random(n) < 0.9
+    # Confirmation follows the box direction about two times in three
+    follows = rng.random(n) < 0.65
+    confirmation = np.where(follows, direction, np.where(direction == 'Long', 'Short', 'Long')).astype(object)
+    confirmation[~confirmed] = None
+    columns[f'{r}_M7Box_Direction'] = direction
+    columns[f'{r}_M7Box_Confirmation_Direction'] = confirmation
+    dr_confirmation = np.where(rng.random(n) < 0.8, confirmation, rng.choice(['Long', 'Short'], n)).astype(object)
+    dr_confirmation[~confirmed] = None
+    columns[f'{r}_DR_Confirmation_Direction'] = dr_confirmation
+    # Written as the export writes them, not as CSV booleans
+    columns[f'{r}_Confirmation_Valid'] = np.where(confirmed & (rng.random(n) < 0.7), 'True', 'False')
+    columns[f'{r}_M7Box_Confirmation_Valid'] = np.where(confirmed & (rng.random(n) < 0.75), 'True', 'False')
+    columns[f'{r} Model'] = rng.choice(MODELS, n, p=[0.3, 0.25, 0.2, 0.15, 0.1])
+    columns[f'{r} M7Box / IDR'] = rng.lognormal(-0.5, 0.45, n).round(3)
+
+    earliest, latest = SESSION_WINDOWS[r]
+    m7box_time = earliest + np.minimum(rng.exponential((latest - earliest) / 4, n), latest - earliest)
+    dr_time = np.minimum(m7box_time + rng.exponential(20, n), latest)
+    for col, minutes in ((f'{r}_M7Box_Confirmation_Time_NY', m7box_time), (f'{r}_DR_Confirmation_Time_NY', dr_time)):
+        times = CLOCK[minutes.astype('int64')]
+        times[~confirmed] = None
+        columns[col] = times
+
+    for kind in ('M7Box', 'DR'):
+        retracement = -rng.gamma(1.6, 0.45, n).round(3)
+        extension = rng.gamma(1.4, 1.1, n).round(3)
+        retracement[~confirmed] = np.nan
+        extension[~confirmed] = np.nan
+        columns[f'{r}_{kind}_Max_Retracement_STD'] = retracement
+        columns[f'{r}_{kind}_Max_Extension_STD'] = extension
+    return columns
+
+
+def generate(n_rows, seed=0, start_row=0):
+    """`n_rows` synthetic export rows as raw strings/numbers, the way read_csv would see them."""
+    rng = np.random.default_rng([seed, start_row])
+    instruments = np.array(INSTRUMENTS)[(np.arange(start_row, start_row + n_rows)) % len(INSTRUMENTS)]
+    trading_day = (np.arange(start_row, start_row + n_rows)) // len(INSTRUMENTS)
+    days, day_of_row = np.unique(trading_day, return_inverse=True)
+    dates = (pd.Timestamp('2000-01-03') + pd.to_timedelta(days // 5 * 7 + days % 5, unit='D')).strftime('%Y-%m-%d')
+    columns = {
+        'Date': np.asarray(dates, dtype=object)[day_of_row],
+        'Instrument': instruments,
+        'Day of Week': np.array(DAYS)[trading_day % 5],
+    }
+    for r in DR_RANGES:
+        columns.update(_range_columns(rng, r, n_rows))
+    columns['ADR Mid Broken '] = rng.choice(MID_BROKEN, n_rows)
+    columns['ODR Mid Broken '] = rng.choice(MID_BROKEN, n_rows)
+    columns['Session High'] = rng.normal(15000, 2000, n_rows).round(2)  # export columns the dashboard ignores
+    columns['Session Low'] = columns['Session High'] - rng.gamma(2, 40, n_rows).round(2)
+    return pd.DataFrame(columns)
+
+
+def write_csv(path, n_rows, seed=0, chunk_rows=CHUNK_ROWS):
+    """Write `n_rows` rows to `path` a chunk at a time, so memory doesn't grow with `n_rows`.
+
+    Arrow's CSV writer is several times faster than DataFrame.to_csv. Nothing is quoted, as in the
+    export; none of the generated values contain a comma or quote.
+    """
+    options = pa_csv.WriteOptions(include_header=False, quoting_style='none')
+    with open(path, 'wb') as f:
+        writer = None
+        for start in range(0, n_rows, chunk_rows):
+            table = pa.Table.from_pandas(generate(min(chunk_rows, n_rows - start), seed, start), preserve_index=False)
+            if writer is None:
+                f.write((','.join(table.column_names) + '\n').encode())
+                writer = pa_csv.CSVWriter(f, table.schema, write_options=options)
+            writer.write_table(table)
+        if writer is not None:
+            writer.close()
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic M7Box export.")
+    parser.add_argument('rows', type=int)
+    parser.add_argument('path')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write_csv(args.path, args.rows, args.seed)
+    print(f"Wrote {args.rows:,} rows to {args.path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""What-if impact of a filter: the sessions and hit rates each of its values would give.
+
+For one filter dimension, the rows matching every other filter and slider are gathered once
+and grouped by that dimension's value in a single pass: a bincount over the value codes gives
+each option's session count, and a bincount over just the rows that hit a target gives its
+hits. A dimension costs one filter and a few bincounts however many options it has, rather
+than one filter run per option. Across dimensions, each filter's bitmap is built once and
+shared by every dimension's "all other filters" mask.
+"""
+import numpy as np
+import pandas as pd
+
+from analysis import ALL, gather
+from metrics import float_values
+from surface import HitTarget
+
+# The tiles' "% of Hitting -1" and "% of Hitting 1", after M7Box and after DR confirmation
+IMPACT_TARGETS = [HitTarget(kind, measure, threshold)
+                  for kind in ('M7Box', 'DR') for measure, threshold in (('Retracement', -1.0), ('Extension', 1.0))]
+
+
+def target_label(target):
+    return f"% of Hitting {target.threshold:g} After {target.kind} Conf."
+
+
+def _value_codes(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy(), list(series.cat.categories)
+    codes, values = pd.factorize(series)
+    return codes, list(values)
+
+
+def _impact_table(df, rows, dr_range, dimension, selections, values, targets):
+    """The impact table of `dimension` over `rows`, the rows matching every other filter."""
+    gathered = gather(df, rows, [dimension] + [target.column_for(dr_range) for target in targets])
+
+    codes, column_values = _value_codes(gathered[dimension])
+    values = column_values if values is None else list(values)
+    # Options the column doesn't hold land in slot 0, which is emptied below, and so have no sessions
+    position = {value: i for i, value in enumerate(column_values)}
+    value_slots = np.array([position.get(value, -1) + 1 for value in values], dtype=np.intp)
+    # Slot 0 collects the rows missing a value (code -1): they count for "All" but no single option
+    slots = codes.astype(np.intp) + 1
+    sessions = np.bincount(slots, minlength=len(column_values) + 1)
+    sessions[0] = 0
+
+    table = {dimension: [ALL] + values, 'Sessions': np.concatenate([[len(rows)], sessions[value_slots]])}
+    for target in targets:
+        hit = target.hits(float_values(gathered[target.column_for(dr_range)]))
+        hits = np.bincount(slots, weights=hit, minlength=len(column_values) + 1).astype(np.int64)
+        hits[0] = 0
+        hit_counts = np.concatenate([[hit.sum()], hits[value_slots]])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            table[target_label(target)] = np.where(table['Sessions'] > 0, hit_counts / table['Sessions'], np.nan)
+
+    selected = selections.get(dimension)
+    table['Selected'] = [selected is None] + [selected is not None and value in selected for value in values]
+    return pd.DataFrame(table)
+
+
+def filter_impacts(df, filter_index, dr_range, dimensions, selections, windows=None, options=None,
+                   targets=IMPACT_TARGETS):
+    """{dimension: impact table} for each of `dimensions`, the other filters fixed.
+
+    Each table's first row is "All" (no filter on that dimension), then one row per value in
+    `options[dimension]` (every value of the column by default), with `Selected` marking the
+    current choice. Probabilities are over every session, as on the tiles, and missing where
+    there are none.
+
+    The slider windows and the filters on other columns are one bitmap, and each dimension's
+    selection is matched once; "every filter but this one" is then the AND of the bitmaps
+    before and after it, from running prefix and suffix ANDs.
+    """
+    options = options or {}
+    base = filter_index.everything()
+    for col, choice in selections.items():
+        if col not in dimensions:
+            base &= filter_index.match(col, choice)
+    for col, (lo, hi) in (windows or {}).items():
+        base &= filter_index.in_range(col, lo, hi)
+    matches = [filter_index.match(dim, selections[dim]) if dim in selections else filter_index.everything()
+               for dim in dimensions]
+
+    # before[i]: base and every dimension before i; after[i]: every dimension after i
+    before, after = [base], [filter_index.everything()]
+    for match in matches[:-1]:
+        before.append(before[-1] & match)
+    for match in matches[:0:-1]:
+        after.append(after[-1] & match)
+    after.reverse()
+
+    return {dim: _impact_table(df, filter_index.rows(before[i] & after[i]), dr_range, dim, selections,
+                               options.get(dim), targets)
+            for i, dim in enumerate(dimensions)}
+